@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Micro-benchmark of the per query/target coverage computation in bin/anicalc.py
+#
+# Example usage: python benchmarks/anicalc_compute_cov.py --hsps 10 100 1000 10000
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import timeit
+
+import numpy as np
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+sys.path.insert(0, BIN)
+
+
+def load_anicalc():
+    path = os.path.join(BIN, "anicalc.py")
+    spec = importlib.util.spec_from_file_location("anicalc", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def list_compute_cov(alns):
+    # previous list-of-lists implementation, kept as the baseline
+    cov = []
+    for coords_key, len_key in (("qcoords", "qlen"), ("tcoords", "tlen")):
+        coords = sorted([list(a[coords_key]) for a in alns])
+        nr_coords = [coords[0]]
+        for start, stop in coords[1:]:
+            if start <= (nr_coords[-1][1] + 1):
+                nr_coords[-1][1] = max(nr_coords[-1][1], stop)
+            else:
+                nr_coords.append([start, stop])
+        alen = sum([stop - start + 1 for start, stop in nr_coords])
+        cov.append(round(100.0 * alen / alns[0][len_key], 2))
+    return tuple(cov)
+
+
+def simulate_block(num_hsps, qlen=50000, tlen=50000):
+    # repetitive prophage-like block: many short, heavily overlapping HSPs
+    alns = []
+    for _ in range(num_hsps):
+        length = random.randint(30, 500)
+        qstart, tstart = random.randint(1, qlen - length), random.randint(1, tlen - length)
+        alns.append(
+            {
+                "qcoords": [qstart, qstart + length],
+                "tcoords": [tstart, tstart + length],
+                "qlen": float(qlen),
+                "tlen": float(tlen),
+            }
+        )
+    return alns
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Time compute_cov on single blocks with many HSPs.")
+    parser.add_argument("--hsps", type=int, nargs="+", default=[10, 100, 1000, 10000], help="HSPs per block")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repeats (best is reported)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    random.seed(args.seed)
+    anicalc = load_anicalc()
+    print("hsps\tlist_us\tcompute_cov_us\tspeedup")
+    for num_hsps in args.hsps:
+        alns = simulate_block(num_hsps)
+        assert list_compute_cov(alns) == anicalc.compute_cov(alns)
+        number = max(1, 20000 // num_hsps)
+        list_time = min(timeit.repeat(lambda: list_compute_cov(alns), number=number, repeat=args.repeat)) / number
+        array_time = min(timeit.repeat(lambda: anicalc.compute_cov(alns), number=number, repeat=args.repeat)) / number
+        print("%s\t%.1f\t%.1f\t%.1fx" % (num_hsps, list_time * 1e6, array_time * 1e6, list_time / array_time))
+    # columnar engine: all blocks of a chunk in one call
+    blocks = [simulate_block(random.choice(args.hsps)) for _ in range(50)]
+    offsets = np.cumsum([0] + [len(b) for b in blocks[:-1]])
+    starts = np.array([a["qcoords"][0] for b in blocks for a in b], dtype=np.int64)
+    stops = np.array([a["qcoords"][1] for b in blocks for a in b], dtype=np.int64)
+    elapsed = min(timeit.repeat(lambda: anicalc.segment_union_lengths(offsets, starts, stops), number=5, repeat=3)) / 5
+    print(
+        "segment_union_lengths: %s blocks, %s HSPs, %.1f us per block"
+        % (len(blocks), len(starts), elapsed * 1e6 / len(blocks))
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Benchmark of selecting and renaming FASTA records with bin/fasta_io.py against the Biopython path
+#
+# Example usage: python benchmarks/fasta_io_select.py --records 20000 --length 20000 --select 0.5
+
+import argparse
+import filecmp
+import gzip
+import os
+import random
+import sys
+import tempfile
+import time
+
+from Bio import SeqIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+from fasta_io import prefix_records, read_records, select_records, write_records  # noqa: E402
+
+
+def biopython_select(fasta, ids, prefix, output):
+    # previous SeqIO implementation, kept as the baseline
+    records = []
+    with gzip.open(fasta, "rt") as handle:
+        for record in SeqIO.parse(handle, "fasta"):
+            if record.id in ids:
+                record.id = prefix + "|" + record.id
+                records.append(record)
+    SeqIO.write(records, output, "fasta")
+
+
+def fasta_io_select(fasta, ids, prefix, output):
+    write_records(prefix_records(select_records(read_records(fasta), ids), prefix), output)
+
+
+def simulate_fasta(path, num_records, mean_length, wrap):
+    ids = []
+    with gzip.open(path, "wt", compresslevel=1) as handle:
+        for i in range(num_records):
+            length = random.randint(mean_length // 2, mean_length * 3 // 2)
+            sequence = "".join(random.choices("ACGT", k=length))
+            ids.append("contig_%s" % i)
+            handle.write(">contig_%s length=%s\n" % (i, length))
+            handle.write("\n".join([sequence[j : j + wrap] for j in range(0, length, wrap)]) + "\n")
+    return ids
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Time selecting and renaming FASTA records.")
+    parser.add_argument("--records", type=int, default=20000, help="Number of records")
+    parser.add_argument("--length", type=int, default=20000, help="Mean record length")
+    parser.add_argument("--select", type=float, default=0.5, help="Fraction of records selected")
+    parser.add_argument("--wrap", type=int, nargs="+", default=[60, 80], help="Input line widths")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    random.seed(args.seed)
+    print("wrap\tbiopython_s\tfasta_io_s\tspeedup")
+    with tempfile.TemporaryDirectory() as tmp:
+        for wrap in args.wrap:
+            fasta = os.path.join(tmp, "input.fna.gz")
+            ids = simulate_fasta(fasta, args.records, args.length, wrap)
+            ids = set(random.sample(ids, int(len(ids) * args.select)))
+            timings = []
+            for function in (biopython_select, fasta_io_select):
+                output = os.path.join(tmp, function.__name__ + ".fna")
+                start = time.perf_counter()
+                function(fasta, ids, "sample", output)
+                timings.append(time.perf_counter() - start)
+            assert filecmp.cmp(*[os.path.join(tmp, f.__name__ + ".fna") for f in (biopython_select, fasta_io_select)])
+            print("%s\t%.2f\t%.2f\t%.1fx" % (wrap, timings[0], timings[1], timings[0] / timings[1]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
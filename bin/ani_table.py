@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# Binary ANI table shared by anicalc.py (writer) and aniclust.py (reader)
+#
+# The table is a NumPy .npz archive with one entry per column:
+#   names     uint8    newline-joined sequence IDs (UTF-8), indexed by qidx/tidx
+#   qidx      int32    query sequence index into names
+#   tidx      int32    target sequence index into names
+#   num_alns  int32    number of alignments
+#   pid       float32  average nucleotide identity
+#   qcov      float32  query coverage
+#   tcov      float32  target coverage
+
+import array
+
+import numpy as np
+
+
+def as_array(buffer, dtype):
+    # np.frombuffer refuses empty buffers on older NumPy releases
+    return np.frombuffer(buffer, dtype=dtype) if len(buffer) else np.empty(0, dtype=dtype)
+
+
+class AniTableWriter:
+    """Collect ANI rows with interned sequence IDs and save them as a binary ANI table"""
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = {}
+        self.qidx, self.tidx, self.num_alns = array.array("i"), array.array("i"), array.array("i")
+        self.pid, self.qcov, self.tcov = array.array("f"), array.array("f"), array.array("f")
+
+    def intern(self, name):
+        index = self.ids.get(name)
+        if index is None:
+            index = self.ids[name] = len(self.ids)
+        return index
+
+    def write_rows(self, rows):
+        for qname, tname, num_alns, pid, qcov, tcov in rows:
+            self.qidx.append(self.intern(qname))
+            self.tidx.append(self.intern(tname))
+            self.num_alns.append(num_alns)
+            self.pid.append(pid)
+            self.qcov.append(qcov)
+            self.tcov.append(tcov)
+
+    def write_no_alignments(self):
+        pass
+
+    def close(self):
+        # np.savez appends .npz to paths without it, so write through a handle
+        with open(self.path, "wb") as handle:
+            np.savez(
+                handle,
+                names=as_array("\n".join(self.ids).encode(), np.uint8),
+                qidx=as_array(self.qidx, np.int32),
+                tidx=as_array(self.tidx, np.int32),
+                num_alns=as_array(self.num_alns, np.int32),
+                pid=as_array(self.pid, np.float32),
+                qcov=as_array(self.qcov, np.float32),
+                tcov=as_array(self.tcov, np.float32),
+            )
+
+
+def read_ani_table(path):
+    """Return (names, columns) of a binary ANI table, where columns maps column name to array"""
+    with np.load(path, allow_pickle=False) as table:
+        columns = {key: table[key] for key in table.files}
+    blob = columns.pop("names").tobytes().decode()
+    names = blob.split("\n") if blob else []
+    return names, columns
+
+
+def is_ani_table(path):
+    return path.endswith(".npz")
@@ -5,7 +5,32 @@
 import Bio.SeqIO, time, gzip
 from operator import itemgetter
 import numpy as np, argparse
+import pandas as pd
 import os
+import io
+import itertools
+import multiprocessing
+
+from ani_table import AniTableWriter, is_ani_table
+
+
+# columns of the 'std 6 qlen slen' format used by the columnar reader
+BLAST_COLUMNS = {
+    0: "qname",
+    1: "tname",
+    2: "pid",
+    3: "len",
+    6: "qstart",
+    7: "qend",
+    8: "tstart",
+    9: "tend",
+    10: "evalue",
+    12: "qlen",
+    13: "tlen",
+}
+
+# blocks with fewer alignments are merged in pure Python by compute_cov (see benchmarks/)
+ARRAY_MIN_ALNS = 64
 
 
 def parse_blast(handle):
@@ -59,38 +84,373 @@ def compute_ani(alns):
     return round(sum(a["len"] * a["pid"] for a in alns) / sum(a["len"] for a in alns), 2)
 
 
-def compute_cov(alns):
-    # merge qcoords
-    coords = sorted([a["qcoords"] for a in alns])
-    nr_coords = [coords[0]]
+def merge_sorted_intervals(starts, reach, first):
+    """Sweep intervals sorted by start and return the lengths of the merged runs
+
+    `reach` is the cumulative max of the stops and `first` flags intervals that must open a run.
+    Overlapping or adjacent intervals (start <= reach + 1) are merged.
+    """
+    opens = first.copy()
+    opens[1:] |= starts[1:] > reach[:-1] + 1
+    closes = np.append(opens[1:], True)
+    return opens, reach[closes] - starts[opens] + 1
+
+
+def interval_union_length(starts, stops):
+    """Return the number of positions covered by the union of closed intervals [start, stop]"""
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order]
+    first = np.zeros(len(starts), dtype=bool)
+    first[0] = True
+    opens, run_lengths = merge_sorted_intervals(starts, np.maximum.accumulate(stops[order]), first)
+    return int(run_lengths.sum())
+
+
+def sorted_union_length(coords):
+    """Pure Python interval union, cheaper than interval_union_length on a handful of intervals"""
+    coords = sorted(coords)
+    alen, (run_start, reach) = 0, coords[0]
     for start, stop in coords[1:]:
-        # overlapping, update start coord
-        if start <= (nr_coords[-1][1] + 1):
-            nr_coords[-1][1] = max(nr_coords[-1][1], stop)
-        # non-overlapping, append to list
+        if start <= reach + 1:
+            reach = max(reach, stop)
         else:
-            nr_coords.append([start, stop])
-    # compute qry_cov
-    alen = sum([stop - start + 1 for start, stop in nr_coords])
+            alen += reach - run_start + 1
+            run_start, reach = start, stop
+    return alen + reach - run_start + 1
+
+
+def union_length(coords):
+    """Return the number of positions covered by a list of [start, stop] coords"""
+    if len(coords) < ARRAY_MIN_ALNS:
+        return sorted_union_length(coords)
+    coords = np.fromiter(itertools.chain.from_iterable(coords), dtype=np.int64, count=2 * len(coords))
+    return interval_union_length(coords[0::2], coords[1::2])
+
+
+def compute_cov(alns):
+    # merge qcoords
+    alen = union_length([a["qcoords"] for a in alns])
     qcov = round(100.0 * alen / alns[0]["qlen"], 2)
 
     # merge tcoords
-    coords = sorted([a["tcoords"] for a in alns])
-    nr_coords = [coords[0]]
-    for start, stop in coords[1:]:
-        # overlapping, update start coord
-        if start <= (nr_coords[-1][1] + 1):
-            nr_coords[-1][1] = max(nr_coords[-1][1], stop)
-        # non-overlapping, append to list
-        else:
-            nr_coords.append([start, stop])
-    # compute qry_cov
-    alen = sum([stop - start + 1 for start, stop in nr_coords])
+    alen = union_length([a["tcoords"] for a in alns])
     tcov = round(100.0 * alen / alns[0]["tlen"], 2)
 
     return qcov, tcov
 
 
+class AlignmentBlock:
+    """Running ANI and coverage state of one (qname, tname) block, used by the streaming engine"""
+
+    __slots__ = ["qname", "tname", "qlen", "tlen", "num_alns", "numer", "denom", "qcoords", "tcoords"]
+
+    def __init__(self, qname, tname, qlen, tlen):
+        self.qname, self.tname = qname, tname
+        self.qlen, self.tlen = qlen, tlen
+        self.num_alns, self.numer, self.denom = 0, 0, 0
+        self.qcoords, self.tcoords = [], []
+
+    def add(self, pid, length, qstart, qend, tstart, tend):
+        self.num_alns += 1
+        self.numer += length * pid
+        self.denom += length
+        self.qcoords.append((qstart, qend) if qstart <= qend else (qend, qstart))
+        self.tcoords.append((tstart, tend) if tstart <= tend else (tend, tstart))
+
+    def row(self):
+        ani = round(self.numer / self.denom, 2)
+        qcov = round(100.0 * union_length(self.qcoords) / self.qlen, 2)
+        tcov = round(100.0 * union_length(self.tcoords) / self.tlen, 2)
+        return [self.qname, self.tname, self.num_alns, ani, qcov, tcov]
+
+
+def compute_streaming(handle, min_length, min_evalue, out):
+    """Write ANI rows to the writer `out` one block at a time and return whether any non-self alignment was found
+
+    Alignments failing the length/e-value filter are dropped as soon as their line is split, so only
+    the coordinates of surviving alignments of the current block are held in memory.
+    """
+    has_alns, key, block = False, None, None
+    for line in handle:
+        r = line.split()
+        # skip self hits
+        if r[0] == r[1]:
+            continue
+        has_alns = True
+        if (r[0], r[1]) != key:
+            if block is not None:
+                out.write_rows([block.row()])
+            key, block = (r[0], r[1]), None
+        length = float(r[3])
+        if length < min_length or float(r[-4]) > min_evalue:
+            continue
+        if block is None:
+            block = AlignmentBlock(r[0], r[1], float(r[-2]), float(r[-1]))
+        block.add(float(r[2]), length, int(r[6]), int(r[7]), int(r[8]), int(r[9]))
+    if block is not None:
+        out.write_rows([block.row()])
+    return has_alns
+
+
+class ByteRange:
+    """Read-only file object limited to bytes [start, end) of a file"""
+
+    def __init__(self, path, start, end):
+        self.handle = open(path, "rb")
+        self.handle.seek(start)
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.handle.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        while self.remaining > 0:
+            line = self.handle.readline(self.remaining)
+            if not line:
+                break
+            self.remaining -= len(line)
+            yield line
+
+    def close(self):
+        self.handle.close()
+
+
+def find_block_start(handle, offset):
+    """Return the first line start at or after `offset` that begins a new (qname, tname) block
+
+    Self hits are skipped without closing a block, so the returned line is always a non-self hit
+    whose key differs from the last non-self hit before it.
+    """
+    handle.seek(offset)
+    if offset > 0:
+        handle.seek(offset - 1)
+        handle.readline()
+    prev_key = None
+    while True:
+        position = handle.tell()
+        line = handle.readline()
+        if not line:
+            return position
+        r = line.split(b"\t", 2)
+        if r[0] == r[1]:
+            continue
+        if prev_key is not None and (r[0], r[1]) != prev_key:
+            return position
+        prev_key = (r[0], r[1])
+
+
+def shard_blast(path, num_shards):
+    """Split an uncompressed BLAST file into byte ranges that do not cut through alignment blocks"""
+    size = os.path.getsize(path)
+    with open(path, "rb") as handle:
+        bounds = [0]
+        for i in range(1, num_shards):
+            bounds.append(max(bounds[-1], find_block_start(handle, size * i // num_shards)))
+        bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def read_blast_chunks(path, chunksize):
+    """Yield the BLAST table (path or file object) as DataFrames of at most `chunksize` rows"""
+    try:
+        reader = pd.read_csv(
+            path,
+            sep="\t",
+            header=None,
+            usecols=list(BLAST_COLUMNS),
+            dtype={0: str, 1: str},
+            na_filter=False,
+            chunksize=chunksize,
+        )
+        for chunk in reader:
+            yield chunk.rename(columns=BLAST_COLUMNS)
+    except pd.errors.EmptyDataError:
+        return
+
+
+def yield_columnar_blocks(chunks, min_length=0, min_evalue=1e-3):
+    """Yield dicts of NumPy arrays holding consecutive (qname, tname) alignment blocks
+
+    Blocks are delimited on non-self hits before pruning, exactly like yield_alignment_blocks. Only
+    the rows surviving prune_alns are kept, so blocks where every alignment is pruned are dropped
+    and a yielded dict may be empty. The last block of each chunk is carried over, since it may
+    continue in the next chunk.
+    """
+    carry_key, carry = None, None
+    for chunk in chunks:
+        qname = chunk["qname"].to_numpy(dtype=object)
+        tname = chunk["tname"].to_numpy(dtype=object)
+        nonself = qname != tname
+        chunk, qname, tname = chunk[nonself], qname[nonself], tname[nonself]
+        if len(chunk) == 0:
+            continue
+        # find block boundaries (first row of chunk continues the carried block if keys match)
+        new_block = np.empty(len(chunk), dtype=bool)
+        new_block[0] = (qname[0], tname[0]) != carry_key
+        new_block[1:] = (qname[1:] != qname[:-1]) | (tname[1:] != tname[:-1])
+        block_ids = np.cumsum(new_block)
+        # prune alignments
+        keep = (chunk["len"].to_numpy() >= min_length) & (chunk["evalue"].to_numpy() <= min_evalue)
+        rows = {
+            "block": block_ids[keep],
+            "qname": qname[keep],
+            "tname": tname[keep],
+            "pid": chunk["pid"].to_numpy(dtype=float)[keep],
+            "len": chunk["len"].to_numpy(dtype=float)[keep],
+            "qstart": chunk["qstart"].to_numpy(dtype=np.int64)[keep],
+            "qend": chunk["qend"].to_numpy(dtype=np.int64)[keep],
+            "tstart": chunk["tstart"].to_numpy(dtype=np.int64)[keep],
+            "tend": chunk["tend"].to_numpy(dtype=np.int64)[keep],
+            "qlen": chunk["qlen"].to_numpy(dtype=float)[keep],
+            "tlen": chunk["tlen"].to_numpy(dtype=float)[keep],
+        }
+        # prepend rows of the carried block (block id 0 continues it, otherwise it is complete)
+        if carry is not None:
+            if new_block[0]:
+                yield carry
+            else:
+                rows = {k: np.concatenate([carry[k], v]) for k, v in rows.items()}
+                rows["block"][: len(carry["block"])] = 0
+        # hold back the last block
+        last_block = block_ids[-1]
+        tail = rows["block"] == last_block
+        carry_key = (qname[-1], tname[-1])
+        carry = {k: v[tail] for k, v in rows.items()}
+        carry["block"][:] = 0
+        yield {k: v[~tail] for k, v in rows.items()}
+        if len(carry["block"]) == 0:
+            carry = None
+    if carry is not None:
+        yield carry
+
+
+def segment_sequential_sum(values, offsets, counts):
+    """Sum contiguous segments of `values` strictly left to right
+
+    Matches the floating point result of Python's sum() over each segment, which np.add.reduceat
+    does not guarantee since it sums pairwise.
+    """
+    sums = np.zeros(len(offsets))
+    # visit segments longest first so the active ones are always a prefix
+    order = np.argsort(-counts, kind="stable")
+    sorted_counts = counts[order]
+    for k in range(int(sorted_counts[0]) if len(counts) else 0):
+        active = order[: np.searchsorted(-sorted_counts, -k, side="left")]
+        sums[active] += values[offsets[active] + k]
+    return sums
+
+
+def segment_union_lengths(offsets, starts, stops):
+    """Return the number of positions covered by the union of the intervals in each segment"""
+    n = len(starts)
+    segment = np.repeat(np.arange(len(offsets)), np.diff(np.append(offsets, n)))
+    order = np.lexsort((starts, segment))
+    segment, starts, stops = segment[order], starts[order], stops[order]
+    # running max of stops within segments, offset so earlier segments never carry over
+    shift = int(stops.max()) + 2 if n else 0
+    reach = np.maximum.accumulate(stops + segment * shift) - segment * shift
+    first = np.ones(n, dtype=bool)
+    first[1:] = segment[1:] != segment[:-1]
+    opens, run_lengths = merge_sorted_intervals(starts, reach, first)
+    run_segments = segment[opens]
+    return np.add.reduceat(run_lengths, np.flatnonzero(np.append(True, run_segments[1:] != run_segments[:-1])))
+
+
+def compute_block_stats(block):
+    """Return (qname, tname, num_alns, ani, qcov, tcov) rows for a columnar chunk of blocks"""
+    offsets = np.flatnonzero(np.append(True, block["block"][1:] != block["block"][:-1]))
+    counts = np.diff(np.append(offsets, len(block["block"])))
+    numer = segment_sequential_sum(block["len"] * block["pid"], offsets, counts)
+    denom = np.add.reduceat(block["len"], offsets)
+    qcov = 100.0 * segment_union_lengths(
+        offsets, np.minimum(block["qstart"], block["qend"]), np.maximum(block["qstart"], block["qend"])
+    )
+    qcov /= block["qlen"][offsets]
+    tcov = 100.0 * segment_union_lengths(
+        offsets, np.minimum(block["tstart"], block["tend"]), np.maximum(block["tstart"], block["tend"])
+    )
+    tcov /= block["tlen"][offsets]
+    return zip(
+        block["qname"][offsets].tolist(),
+        block["tname"][offsets].tolist(),
+        counts.tolist(),
+        [round(x, 2) for x in (numer / denom).tolist()],
+        [round(x, 2) for x in qcov.tolist()],
+        [round(x, 2) for x in tcov.tolist()],
+    )
+
+
+def format_rows(rows):
+    return "".join(["\t".join([str(_) for _ in row]) + "\n" for row in rows])
+
+
+class AniTsvWriter:
+    """Write ANI rows as the tab-delimited ANI table"""
+
+    fields = ["qname", "tname", "num_alns", "pid", "qcov", "tcov"]
+
+    def __init__(self, handle, header=True):
+        self.handle = handle
+        if header:
+            self.handle.write("\t".join(self.fields) + "\n")
+
+    def write_rows(self, rows):
+        self.handle.write(format_rows(rows))
+
+    def write_text(self, text):
+        self.handle.write(text)
+
+    def write_no_alignments(self):
+        self.handle.write("No virus alignments using specified thresholds")
+
+    def close(self):
+        self.handle.close()
+
+
+class AniRowBuffer:
+    """Keep ANI rows in memory, used to return the rows of a shard to the parent process"""
+
+    def __init__(self):
+        self.rows = []
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+
+
+def open_ani_writer(path):
+    """Return a binary ANI table writer for .npz paths, otherwise a (gzipped) TSV writer"""
+    if is_ani_table(path):
+        return AniTableWriter(path)
+    return AniTsvWriter(gzip.open(path, "wt") if path.split(".")[-1] == "gz" else open(path, "w"))
+
+
+def compute_columnar(handle, chunksize, min_length, min_evalue, out):
+    """Write ANI rows to the writer `out` and return whether any non-self alignment was found"""
+    has_alns = False
+    for block in yield_columnar_blocks(read_blast_chunks(handle, chunksize), min_length, min_evalue):
+        has_alns = True
+        if len(block["block"]) == 0:
+            continue
+        out.write_rows(compute_block_stats(block))
+    return has_alns
+
+
+def compute_shard(shard):
+    """Return whether a shard has non-self alignments, and its rows as TSV text or as a list"""
+    path, start, end, chunksize, min_length, min_evalue, as_text = shard
+    handle = ByteRange(path, start, end)
+    out = AniTsvWriter(io.StringIO(), header=False) if as_text else AniRowBuffer()
+    try:
+        has_alns = compute_columnar(handle, chunksize, min_length, min_evalue, out)
+        return has_alns, out.handle.getvalue() if as_text else out.rows
+    finally:
+        handle.close()
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -101,26 +461,99 @@ def parse_arguments():
         metavar="PATH",
         help="path to blastn input file (format: 'std 6 qlen slen')",
     )
-    parser.add_argument("-o", dest="output", type=str, required=True, metavar="PATH", help="path to ani file")
-    parser.add_argument("-l", dest="length", type=int, metavar="INT", help="minimum alignment length to keep")
+    parser.add_argument(
+        "-o",
+        dest="output",
+        type=str,
+        required=True,
+        metavar="PATH",
+        help="path to ani file (TSV, or binary ANI table read by aniclust.py if it ends with .npz)",
+    )
+    parser.add_argument(
+        "-l",
+        "--length",
+        dest="length",
+        type=int,
+        default=0,
+        metavar="INT",
+        help="minimum alignment length to keep (default=0)",
+    )
+    parser.add_argument(
+        "-e",
+        "--evalue",
+        dest="evalue",
+        type=float,
+        default=1e-3,
+        metavar="FLOAT",
+        help="maximum alignment e-value to keep (default=1e-3)",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["columnar", "streaming", "python"],
+        default="columnar",
+        help="compute ANI on NumPy arrays read in chunks (columnar), one block at a time with alignments "
+        "filtered while parsing (streaming) or from per-alignment records (python)",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=1000000,
+        metavar="INT",
+        help="number of BLAST lines per chunk read by the columnar engine (default=1000000)",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        metavar="INT",
+        help="number of processes used by the columnar engine on uncompressed input (default=1)",
+    )
     return vars(parser.parse_args())
 
 
 if __name__ == "__main__":
     args = parse_arguments()
-    out = gzip.open(args["output"], "w") if args["output"].split(".")[-1] == "gz" else open(args["output"], "w")
-    fields = ["qname", "tname", "num_alns", "pid", "qcov", "tcov"]
-    out.write("\t".join(fields) + "\n")
-    input = gzip.open(args["input"]) if args["input"].split(".")[-1] == "gz" else open(args["input"])
-    for alns in yield_alignment_blocks(input):
-        if alns:
-            alns = prune_alns(alns)
-            if len(alns) == 0:
-                continue
-            qname, tname = alns[0]["qname"], alns[0]["tname"]
-            ani = compute_ani(alns)
-            qcov, tcov = compute_cov(alns)
-            row = [qname, tname, len(alns), ani, qcov, tcov]
-            out.write("\t".join([str(_) for _ in row]) + "\n")
-        else:
-            out.write("No virus alignments using specified thresholds")
+    out = open_ani_writer(args["output"])
+    if args["engine"] == "columnar" and args["threads"] > 1 and args["input"].split(".")[-1] != "gz":
+        # several shards per process keep per-shard results small and balance the load
+        as_text = isinstance(out, AniTsvWriter)
+        shards = shard_blast(args["input"], args["threads"] * 4)
+        shards = [
+            (args["input"], start, end, args["chunksize"], args["length"], args["evalue"], as_text)
+            for start, end in shards
+        ]
+        has_alns = False
+        with multiprocessing.Pool(args["threads"]) as pool:
+            # imap returns shard results in input order
+            for shard_has_alns, rows in pool.imap(compute_shard, shards):
+                has_alns = has_alns or shard_has_alns
+                if as_text:
+                    out.write_text(rows)
+                else:
+                    out.write_rows(rows)
+        if not has_alns:
+            out.write_no_alignments()
+    elif args["engine"] == "columnar":
+        if not compute_columnar(args["input"], args["chunksize"], args["length"], args["evalue"], out):
+            out.write_no_alignments()
+    elif args["engine"] == "streaming":
+        input = gzip.open(args["input"], "rt") if args["input"].split(".")[-1] == "gz" else open(args["input"])
+        if not compute_streaming(input, args["length"], args["evalue"], out):
+            out.write_no_alignments()
+    else:
+        input = gzip.open(args["input"], "rt") if args["input"].split(".")[-1] == "gz" else open(args["input"])
+        for alns in yield_alignment_blocks(input):
+            if alns:
+                alns = prune_alns(alns, args["length"], args["evalue"])
+                if len(alns) == 0:
+                    continue
+                qname, tname = alns[0]["qname"], alns[0]["tname"]
+                ani = compute_ani(alns)
+                qcov, tcov = compute_cov(alns)
+                row = [qname, tname, len(alns), ani, qcov, tcov]
+                out.write_rows([row])
+            else:
+                out.write_no_alignments()
+    out.close()
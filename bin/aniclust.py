@@ -2,22 +2,16 @@
 
 # Code taken from https://bitbucket.org/berkeleylab/checkv/src/master/scripts/aniclust.py
 
-import time, resource, platform, sys, argparse, gzip
+import time, resource, platform, sys, argparse, gzip, os
+import numpy as np
+import pandas as pd
 
+from ani_table import is_ani_table, read_ani_table
+from fasta_io import fasta_lengths
 
-def parse_seqs(path):
-    handle = gzip.open(path, "rt") if path.split(".")[-1] == "gz" else open(path)
-    id = next(handle).split()[0][1:]
-    seq = ""
-    for line in handle:
-        if line[0] == ">":
-            yield id, seq
-            id = line.split()[0][1:]
-            seq = ""
-        else:
-            seq += line.rstrip()
-    yield id, seq
-    handle.close()
+
+def open_text(path):
+    return gzip.open(path, "rt") if path.split(".")[-1] == "gz" else open(path)
 
 
 def log_time(start):
@@ -37,6 +31,146 @@ def max_mem_usage():
         return round((max_mem_self + max_mem_child) / float(1e9), 2)
 
 
+# written by anicalc.py instead of ANI rows when no alignments pass its thresholds
+NO_ALIGNMENTS = "No virus alignments"
+
+
+def no_edges():
+    empty = np.empty(0, dtype=np.int32)
+    return empty, empty, {key: np.empty(0) for key in ("ani", "qcov", "tcov")}
+
+
+def store_edges_tsv(path, seq_index, min_ani, min_qcov, min_tcov, chunksize=250000):
+    """Return query indices, target indices and values of edges in a TSV ANI table that pass the thresholds
+
+    The table is read in chunks and filtered with vectorized masks. A table holding only anicalc's
+    "No virus alignments" line, after an optional header, has no edges.
+    """
+    lookup = pd.Index(list(seq_index))
+    with open_text(path) as handle:
+        first_line = handle.readline()
+        header = first_line.split()[:2] == ["qname", "tname"]
+        first_row = handle.readline() if header else first_line
+    if not first_row.strip() or first_row.startswith(NO_ALIGNMENTS):
+        return no_edges()
+    reader = pd.read_csv(
+        path,
+        sep="\t",
+        header=None,
+        skiprows=1 if header else 0,
+        names=["qname", "tname", "num_alns", "ani", "qcov", "tcov"],
+        usecols=["qname", "tname", "ani", "qcov", "tcov"],
+        dtype={"qname": str, "tname": str, "ani": float, "qcov": float, "tcov": float},
+        keep_default_na=False,
+        na_values=[""],
+        chunksize=chunksize,
+    )
+    qnodes, tnodes, values = [], [], {"ani": [], "qcov": [], "tcov": []}
+    for chunk in reader:
+        # sequence indices of IDs, -1 for sequences that were not retained
+        qnode = lookup.get_indexer(chunk["qname"]).astype(np.int32)
+        tnode = lookup.get_indexer(chunk["tname"]).astype(np.int32)
+        passed = (
+            (qnode != tnode)
+            & (qnode >= 0)
+            & (tnode >= 0)
+            & (chunk["qcov"].to_numpy() >= min_qcov)
+            & (chunk["tcov"].to_numpy() >= min_tcov)
+            & (chunk["ani"].to_numpy() >= min_ani)
+        )
+        qnodes.append(qnode[passed])
+        tnodes.append(tnode[passed])
+        for key in values:
+            values[key].append(chunk[key].to_numpy()[passed])
+    if not qnodes:
+        return no_edges()
+    return np.concatenate(qnodes), np.concatenate(tnodes), {key: np.concatenate(values[key]) for key in values}
+
+
+def store_edges_table(path, seq_index, min_ani, min_qcov, min_tcov):
+    """Return query indices, target indices and values of edges in a binary ANI table that pass the thresholds"""
+    names, table = read_ani_table(path)
+    # map table IDs to sequence indices, -1 for sequences that were not retained
+    lookup = np.array([seq_index.get(name, -1) for name in names], dtype=np.int32)
+    qnodes, tnodes = lookup[table["qidx"]], lookup[table["tidx"]]
+    values = {"ani": table["pid"], "qcov": table["qcov"], "tcov": table["tcov"]}
+    passed = (
+        (table["qidx"] != table["tidx"]) & (qnodes >= 0) & (tnodes >= 0) & select_edges(values, min_ani, min_qcov, min_tcov)
+    )
+    return qnodes[passed], tnodes[passed], {key: values[key][passed] for key in values}
+
+
+def select_edges(values, min_ani, min_qcov, min_tcov):
+    """Return a mask of the edges whose values pass the thresholds
+
+    Thresholds are compared at the precision values are stored at (float32 for binary ANI tables),
+    so two-decimal thresholds select the same edges from either table format.
+    """
+    dtype = values["ani"].dtype
+    return (
+        (values["qcov"] >= dtype.type(min_qcov))
+        & (values["tcov"] >= dtype.type(min_tcov))
+        & (values["ani"] >= dtype.type(min_ani))
+    )
+
+
+def parse_thresholds(value):
+    """Parse a MIN_ANI,MIN_QCOV,MIN_TCOV threshold set"""
+    try:
+        min_ani, min_qcov, min_tcov = [float(_) for _ in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected MIN_ANI,MIN_QCOV,MIN_TCOV, got '%s'" % value)
+    return min_ani, min_qcov, min_tcov
+
+
+def thresholds_path(path, min_ani, min_qcov, min_tcov):
+    """Return the output path of clusters at a threshold set, e.g. out_clusters.tsv -> out_clusters_ani97_qcov0_tcov90.tsv"""
+    root, ext = os.path.splitext(path)
+    return "%s_ani%g_qcov%g_tcov%g%s" % (root, min_ani, min_qcov, min_tcov, ext)
+
+
+def build_csr(qnodes, tnodes, num_nodes):
+    """Return (offsets, neighbors) adjacency of the edges, keeping the input order of each node's edges"""
+    order = np.argsort(qnodes, kind="stable")
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(qnodes, minlength=num_nodes), out=offsets[1:])
+    return offsets, tnodes[order].astype(np.int32)
+
+
+def greedy_clusters(offsets, neighbors):
+    """Return (centroid, members) of greedy centroid clusters, visiting nodes in index order
+
+    Each unassigned node becomes a centroid and claims its unassigned neighbors, in edge order.
+    """
+    clusters = []
+    seq_to_clust = np.full(len(offsets) - 1, -1, dtype=np.int32)
+    for seq_id in range(len(offsets) - 1):
+        # seq already been assigned; cant be centroid
+        if seq_to_clust[seq_id] >= 0:
+            continue
+        # seq is centroid for new cluster; add self and unassigned neighbors, first occurrence only
+        mem_ids = neighbors[offsets[seq_id] : offsets[seq_id + 1]]
+        mem_ids = mem_ids[seq_to_clust[mem_ids] < 0]
+        if len(mem_ids) > 1:
+            mem_ids = mem_ids[np.sort(np.unique(mem_ids, return_index=True)[1])]
+        seq_to_clust[seq_id] = seq_id
+        seq_to_clust[mem_ids] = seq_id
+        clusters.append((seq_id, np.append(np.int32(seq_id), mem_ids)))
+    return clusters
+
+
+def read_clusters(path):
+    """Return (centroid, members) of each cluster in an aniclust output file, in file order"""
+    clusters = []
+    with open_text(path) as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            centroid, members = line.rstrip("\n").split("\t")
+            clusters.append((centroid, members.split(",")))
+    return clusters
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawTextHelpFormatter,
@@ -49,7 +183,8 @@ def parse_arguments():
         type=str,
         required=True,
         metavar="PATH",
-        help="""Path to tab-delimited file with fields: [qname, tname, num_alns, ani, qcov, tcov]""",
+        help="""Path to tab-delimited file with fields: [qname, tname, num_alns, ani, qcov, tcov]
+or to a binary ANI table (.npz) written by anicalc.py""",
     )
     parser.add_argument("--out", type=str, required=True, metavar="BASENAME", help="""Path to output file""")
     parser.add_argument(
@@ -79,9 +214,35 @@ def parse_arguments():
         default=70,
         help="""Minimum alignment coverage of shorter sequence (0...100, default=70)""",
     )
+    parser.add_argument(
+        "--thresholds",
+        type=parse_thresholds,
+        nargs="+",
+        default=[],
+        metavar="ANI,QCOV,TCOV",
+        help="""Additional threshold sets to cluster at, e.g. 97,0,90 99,0,95
+The ANI table is loaded once at the loosest thresholds and clusters for each set are written
+next to --out, with the thresholds appended to the file name""",
+    )
     parser.add_argument(
         "--min_length", type=float, metavar="INT", default=1, help="""Minimum sequence length (default=1)"""
     )
+    parser.add_argument(
+        "--prev_clusters",
+        type=str,
+        metavar="PATH",
+        help="""Path to clusters from a previous run (aniclust output) to extend incrementally.
+Previous centroids are kept as centroids and previous members are not re-clustered;
+new sequences in --fna join the cluster of a previous centroid or form new clusters.
+--fna and --ani only need the new sequences and the previous centroids""",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        metavar="INT",
+        default=250000,
+        help="""Number of ANI table rows loaded per chunk (default=250000)""",
+    )
     return vars(parser.parse_args())
 
 
@@ -91,75 +252,77 @@ start = time.time()
 # args
 args = parse_arguments()
 
+# previous clusters, whose centroids are visited before any new sequence
+prev_clusters = read_clusters(args["prev_clusters"]) if args["prev_clusters"] else []
+prev_members = set([_ for centroid, members in prev_clusters for _ in members])
+if args["prev_clusters"]:
+    print("\n%s previous clusters with %s sequences" % (len(prev_clusters), len(prev_members)))
+
 # list seqs, sorted by length
 print("\nreading sequences...")
 seqs = {}
 exclude = set([_.rstrip() for _ in open(args["exclude"])]) if args["exclude"] else None
 keep = set([_.rstrip() for _ in open(args["keep"])]) if args["keep"] else None
-for index, r in enumerate(parse_seqs(args["fna"])):
-    id, seq = r
-    if len(seq) < args["min_length"]:
+# only IDs and lengths are needed, so sequences are never built
+for index, r in enumerate(fasta_lengths(args["fna"])):
+    id, length = r
+    if length < args["min_length"]:
         continue
     elif exclude and id in exclude:
         continue
     elif keep and id not in keep:
         continue
+    elif id in prev_members:
+        continue
     else:
-        seqs[id] = len(seq)
+        seqs[id] = length
 seqs = [x[0] for x in sorted(seqs.items(), key=lambda x: x[1], reverse=True)]
 print("%s sequences retained from fna" % len(seqs))
+num_prev = len(prev_clusters)
+seqs = [centroid for centroid, members in prev_clusters] + seqs
 log_time(start)
 
+# threshold sets, the first one from --min_ani/--min_qcov/--min_tcov is written to --out
+thresholds = [(args["min_ani"], args["min_qcov"], args["min_tcov"], args["out"])]
+for min_ani, min_qcov, min_tcov in args["thresholds"]:
+    thresholds.append((min_ani, min_qcov, min_tcov, thresholds_path(args["out"], min_ani, min_qcov, min_tcov)))
+loosest = [min([_[i] for _ in thresholds]) for i in range(3)]
+
 # store edges
 print("\nstoring edges...")
-num_edges = 0
-edges = dict([(x, []) for x in seqs])
-handle = gzip.open(args["ani"]) if args["ani"].split(".")[-1] == "gz" else open(args["ani"])
-for index, line in enumerate(handle):
-    qname, tname, num_alns, ani, qcov, tcov = line.split()
-    if qname == tname:
-        continue
-    elif qname not in edges or tname not in edges:
-        continue
-    elif float(qcov) < args["min_qcov"] or float(tcov) < args["min_tcov"] or float(ani) < args["min_ani"]:
-        continue
-    edges[qname].append(tname)
-    num_edges += 1
-# 	if not num_edges % 1000000:
-# 		current_time = time.time()
-# 		program_time = round(current_time - start, 2)
-# 		peak_ram = round(max_mem_usage(), 2)
-# 		print("num edges: %s, seconds: %s, GB: %s" % (num_edges, program_time, peak_ram))
-handle.close()
-print("%s edges retained from blastani" % num_edges)
-print("%s edges currently stored" % sum([len(_) for _ in edges.values()]))
+# sequences are interned to their rank in `seqs`, so centroids are visited in index order
+seq_index = dict([(x, i) for i, x in enumerate(seqs)])
+if is_ani_table(args["ani"]):
+    qnodes, tnodes, values = store_edges_table(args["ani"], seq_index, *loosest)
+else:
+    qnodes, tnodes, values = store_edges_tsv(args["ani"], seq_index, *loosest, chunksize=args["chunksize"])
+# previous centroids can't be claimed by another centroid
+if num_prev:
+    passed = tnodes >= num_prev
+    qnodes, tnodes = qnodes[passed], tnodes[passed]
+    values = {key: values[key][passed] for key in values}
+print("%s edges retained from blastani" % len(qnodes))
 log_time(start)
 
-# cluster
-print("\nclustering...")
-clust_to_seqs = {}
-seq_to_clust = {}
-# loop over seqs in sorted order
-for seq_id in seqs:
-    # seq already been assigned; cant be centroid
-    if seq_id in seq_to_clust:
-        continue
-    # seq is centroid for new cluster
-    else:
-        # add self to cluster
-        clust_to_seqs[seq_id] = [seq_id]
-        seq_to_clust[seq_id] = seq_id
-        # update with cluster members
-        for mem_id in edges[seq_id]:
-            if mem_id not in seq_to_clust:
-                clust_to_seqs[seq_id].append(mem_id)
-                seq_to_clust[mem_id] = seq_id
-print("%s total clusters" % len(clust_to_seqs))
-log_time(start)
+for min_ani, min_qcov, min_tcov, path in thresholds:
+    # cluster
+    print("\nclustering (min_ani=%g, min_qcov=%g, min_tcov=%g)..." % (min_ani, min_qcov, min_tcov))
+    passed = select_edges(values, min_ani, min_qcov, min_tcov)
+    offsets, neighbors = build_csr(qnodes[passed], tnodes[passed], len(seqs))
+    print("%s edges currently stored" % len(neighbors))
+    clusters = greedy_clusters(offsets, neighbors)
+    del offsets, neighbors
+    print("%s total clusters" % len(clusters))
+    log_time(start)
 
-# write
-print("\nwriting clusters...")
-out = open(args["out"], "w")
-for seq_id, mem_ids in clust_to_seqs.items():
-    out.write(seq_id + "\t" + ",".join(mem_ids) + "\n")
-log_time(start)
+    # write
+    print("\nwriting clusters to %s..." % path)
+    out = open(path, "w")
+    for centroid, members in clusters:
+        names = [seqs[_] for _ in members.tolist()]
+        if centroid < num_prev:
+            # previous clusters keep their members and are extended with the new ones
+            names = prev_clusters[centroid][1] + names[1:]
+        out.write(seqs[centroid] + "\t" + ",".join(names) + "\n")
+    out.close()
+    log_time(start)
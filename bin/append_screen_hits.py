@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 
 import argparse
-import pandas as pd
-from Bio import SeqIO
+import csv
+import itertools
 import sys
-import gzip
+
+import numpy as np
+import pandas as pd
+from fasta_io import fetch_records, prefix_records, read_records, select_records, write_records
 
 
 def parse_args(args=None):
@@ -17,11 +20,34 @@ def parse_args(args=None):
         "--reference_fasta",
         help="Path to FASTA file (gzipped) that was sketched with mash sketch, and searched for containment with mash screen.",
     )
+    parser.add_argument(
+        "-i",
+        "--reference_index",
+        help="Path to the SQLite index of a reference store built with build_reference_store.py. When provided, --reference_fasta is the store's BGZF FASTA and hits are fetched by random access instead of scanning it.",
+    )
     parser.add_argument(
         "-s",
         "--mash_screen_results",
         help="Path to the TSV file output by running mash screen.",
     )
+    parser.add_argument(
+        "--min_identity",
+        type=float,
+        default=0.0,
+        help="Minimum mash screen identity for a reference to be appended.",
+    )
+    parser.add_argument(
+        "--min_shared_hashes",
+        type=float,
+        default=0.0,
+        help="Minimum fraction of a reference's hashes found in the reads for it to be appended.",
+    )
+    parser.add_argument(
+        "--max_p_value",
+        type=float,
+        default=1.0,
+        help="Maximum mash screen p-value for a reference to be appended.",
+    )
     parser.add_argument(
         "-f",
         "--assembly_fasta",
@@ -35,41 +61,74 @@ def parse_args(args=None):
     parser.add_argument(
         "-o",
         "--output",
-        help="Output FASTA file containing assemblies and appended mash screen hits.",
+        help="Output FASTA file containing assemblies and appended mash screen hits (gzipped if it ends with .gz).",
     )
     return parser.parse_args(args)
 
 
-def append_screen_hits(reference_fasta, mash_screen_results, assembly_fasta, prefix, output):
-    mash_screen_results_df = pd.read_csv(
-        mash_screen_results,
-        sep="\t",
-        header=None,
-        index_col=False,
-        names=["identity", "shared-hashes", "median-multiplicity", "p-value", "query-id", "query-comment"],
-    )
-    reference_hits = set(mash_screen_results_df["query-id"])
-    contained_genomes = []
-    tested_genomes = set()
-    with gzip.open(reference_fasta, "rt") as reference_fasta_gunzip:
-        for record in SeqIO.parse(reference_fasta_gunzip, "fasta"):
-            if record.id in reference_hits:
-                if record.id in tested_genomes:
-                    continue
-                else:
-                    record.id = "mash_screen|" + record.id
-                    contained_genomes.append(record)
-                    tested_genomes.add(record.id)
-    with gzip.open(assembly_fasta, "rt") as assembly_fasta_gunzip:
-        for record in SeqIO.parse(assembly_fasta_gunzip, "fasta"):
-            record.id = prefix + "|" + record.id
-            contained_genomes.append(record)
-    SeqIO.write(contained_genomes, output, "fasta")
+# mash screen columns, without query-comment
+SCREEN_COLUMNS = {0: "identity", 1: "shared_hashes", 2: "median_multiplicity", 3: "p_value", 4: "query_id"}
+
+
+def read_screen_hits(mash_screen_results, min_identity=0.0, min_shared_hashes=0.0, max_p_value=1.0):
+    """Return the set of reference IDs in mash screen results that pass filtering"""
+    try:
+        screen = pd.read_csv(
+            mash_screen_results,
+            sep="\t",
+            header=None,
+            usecols=list(SCREEN_COLUMNS),
+            dtype={1: str, 4: str},
+            na_filter=False,
+            quoting=csv.QUOTE_NONE,
+        ).rename(columns=SCREEN_COLUMNS)
+    except pd.errors.EmptyDataError:
+        return set()
+
+    # shared hashes are reported as shared/total
+    hashes = screen["shared_hashes"].str.split("/", n=1, expand=True).astype(float).to_numpy()
+    shared_hashes = hashes[:, 0] / np.maximum(hashes[:, 1], 1)
+    identity = screen["identity"].to_numpy(dtype=float)
+    p_value = screen["p_value"].to_numpy(dtype=float)
+    passed = (identity >= min_identity) & (shared_hashes >= min_shared_hashes) & (p_value <= max_p_value)
+    return set(screen["query_id"].to_numpy()[passed])
+
+
+def append_screen_hits(
+    reference_fasta,
+    mash_screen_results,
+    assembly_fasta,
+    prefix,
+    output,
+    reference_index=None,
+    min_identity=0.0,
+    min_shared_hashes=0.0,
+    max_p_value=1.0,
+):
+    reference_hits = read_screen_hits(mash_screen_results, min_identity, min_shared_hashes, max_p_value)
+    # stream reference hits (first record of each original ID) and then the assembly to the output
+    if reference_index:
+        reference_genomes = fetch_records(reference_fasta, reference_index, reference_hits)
+    else:
+        reference_genomes = select_records(read_records(reference_fasta), reference_hits, unique=True)
+    contained_genomes = prefix_records(reference_genomes, "mash_screen")
+    assembly_genomes = prefix_records(read_records(assembly_fasta), prefix)
+    write_records(itertools.chain(contained_genomes, assembly_genomes), output)
 
 
 def main(args=None):
     args = parse_args(args)
-    append_screen_hits(args.reference_fasta, args.mash_screen_results, args.assembly_fasta, args.prefix, args.output)
+    append_screen_hits(
+        args.reference_fasta,
+        args.mash_screen_results,
+        args.assembly_fasta,
+        args.prefix,
+        args.output,
+        args.reference_index,
+        args.min_identity,
+        args.min_shared_hashes,
+        args.max_p_value,
+    )
 
 
 if __name__ == "__main__":
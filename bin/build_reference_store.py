@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+
+from fasta_io import build_record_store, read_records
+
+
+def parse_args(args=None):
+    Description = "Build a random access store of reference sequences, so records can be fetched by ID without scanning the FASTA."
+    Epilog = "Example usage: python build_reference_store.py -r reference.fna.gz -o reference.store.fna.gz"
+
+    parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
+    parser.add_argument(
+        "-r",
+        "--reference_fasta",
+        help="Path to FASTA file (gzipped) containing reference sequences.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Output BGZF FASTA file. The SQLite index of record offsets is written to <output>.sqlite.",
+    )
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    build_record_store(read_records(args.reference_fasta), args.output, args.output + ".sqlite")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,8 @@
 import sys
 import argparse
 import pandas as pd
-from Bio import SeqIO
+
+from fasta_io import fasta_ids
 
 
 def parse_args(args=None):
@@ -25,12 +26,8 @@ def parse_args(args=None):
 
 
 def create_instrain_stb(fasta, output):
-    # create list to store contig names in
-    contig_names = []
-
-    # read in the fasta
-    for record in SeqIO.parse(fasta, "fasta"):
-        contig_names.append(record.id)
+    # read the contig names from the fasta (or its .fai index)
+    contig_names = list(fasta_ids(fasta))
 
     stb_df = pd.DataFrame()
     stb_df["scaffold"] = contig_names
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Decompression of gzip and bzip2 inputs shared by the read QC scripts
+#
+# Compressed files are streamed through the first multi-threaded decompressor found on PATH, which also
+# takes decompression off the reading process. Without one, gzip files are read in-process with
+# python-isal when installed, and otherwise with the gzip and bz2 modules. Keep compatible with Python 3.6.
+
+import gzip
+import bz2
+import shutil
+import subprocess
+
+# decompressors writing to stdout, in order of preference, as (executable, arguments given a thread count)
+DECOMPRESSORS = {
+    ".gz": [
+        ("pigz", lambda threads: ["-dc", "-p", str(threads)]),
+        ("igzip", lambda threads: ["-dc", "-T", str(threads)]),
+        ("zcat", lambda threads: []),
+    ],
+    ".bz2": [
+        ("pbzip2", lambda threads: ["-dc", "-p" + str(threads)]),
+        ("lbzip2", lambda threads: ["-dc", "-n", str(threads)]),
+        ("bzcat", lambda threads: []),
+    ],
+}
+
+
+def compression(path):
+    """Return the compression extension of a path (.gz or .bz2), or None"""
+    for extension in DECOMPRESSORS:
+        if path.endswith(extension):
+            return extension
+    return None
+
+
+def decompress_command(path, threads=1):
+    """Return the command decompressing `path` to stdout, or None for uncompressed files or no decompressor"""
+    extension = compression(path)
+    if extension is None:
+        return None
+    for executable, arguments in DECOMPRESSORS[extension]:
+        if shutil.which(executable):
+            return [executable] + arguments(max(1, threads)) + [path]
+    return None
+
+
+class DecompressedFile:
+    """Binary file object reading the stdout of a decompression command, raising if the command fails"""
+
+    def __init__(self, command):
+        self.command = command
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        self.read = self.process.stdout.read
+        self.readline = self.process.stdout.readline
+
+    def __iter__(self):
+        return iter(self.process.stdout)
+
+    def close(self):
+        eof = not self.process.stdout.read(1)
+        self.process.stdout.close()
+        if not eof:
+            # stopped reading early, so the decompressor may be blocked writing
+            self.process.terminate()
+        if self.process.wait() != 0 and eof:
+            raise subprocess.CalledProcessError(self.process.returncode, self.command)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_decompressed(path, threads=1):
+    """Open a plain, gzipped or bzipped file in binary mode, decompressing with up to `threads` threads"""
+    command = decompress_command(path, threads)
+    if command is not None:
+        return DecompressedFile(command)
+    if compression(path) == ".gz":
+        try:
+            from isal import igzip
+
+            return igzip.open(path, "rb")
+        except ImportError:
+            return gzip.open(path, "rb")
+    elif compression(path) == ".bz2":
+        return bz2.open(path, "rb")
+    return open(path, "rb")
@@ -2,9 +2,9 @@
 
 import argparse
 import pandas as pd
-from Bio import SeqIO
 import sys
-import gzip
+
+from fasta_io import fasta_ids
 
 
 def parse_args(args=None):
@@ -27,10 +27,8 @@ def parse_args(args=None):
 
 def extract_viral_assemblies(virus_fasta, output):
 
-    viral_assemblies = []
-    with gzip.open(virus_fasta, "rt") as reference_fasta_gunzip:
-        for record in SeqIO.parse(reference_fasta_gunzip, "fasta"):
-            viral_assemblies.append(record.id)
+    # only the IDs are needed, so skip parsing the sequences
+    viral_assemblies = list(fasta_ids(virus_fasta))
 
     out = open(output, "w")
     for sequence in viral_assemblies:
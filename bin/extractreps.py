@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 
-from Bio import SeqIO
 import argparse
 import sys
-import gzip
+
+from fasta_io import read_records, select_records, write_records
 
 
 def parse_args(args=None):
@@ -25,32 +25,22 @@ def parse_args(args=None):
     return parser.parse_args(args)
 
 
-def extract_cluster_representatives(fasta, clusters, output):
+def read_cluster_reps(clusters):
     # open clustering results
-    clusters = open(clusters, "r")
-
-    cluster_reps = []
-    for line in clusters:
-        stripped = line.strip()
-        rep, nodes = stripped.split("\t")
-        cluster_reps.append(rep)
-
-    cluster_reps_set = set(cluster_reps)
-
-    # extract representative sequences from fasta file
-    cluster_rep_sequences = []
-    already_added = set()
-
-    fasta_gunzipped = gzip.open(fasta, "rt")
-    for record in SeqIO.parse(fasta_gunzipped, "fasta"):
-        if record.id in already_added:
-            continue
-        if record.id in cluster_reps_set:
-            cluster_rep_sequences.append(record)
-            already_added.add(record.id)
-
-    # save all sequences to specified file
-    SeqIO.write(cluster_rep_sequences, output, "fasta")
+    cluster_reps = set()
+    with open(clusters, "r") as handle:
+        for line in handle:
+            stripped = line.strip()
+            rep, nodes = stripped.split("\t")
+            cluster_reps.add(rep)
+    return cluster_reps
+
+
+def extract_cluster_representatives(fasta, clusters, output):
+    cluster_reps_set = read_cluster_reps(clusters)
+
+    # extract representative sequences from fasta file, streaming them to the output
+    write_records(select_records(read_records(fasta), cluster_reps_set, unique=True), output)
 
 
 def main(args=None):
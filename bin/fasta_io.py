@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+# Lightweight FASTA helpers shared by the bin/ scripts that only need sequence IDs and lengths, or that
+# select and rename records without looking at their sequences
+#
+# Records are (title, block) tuples of raw bytes: the header line without '>' and the sequence lines as
+# they appear in the file. Records are written with the header and 60-column layout of Bio.SeqIO.write,
+# copying the sequence lines through unchanged when they already have that layout.
+
+import gzip
+import os
+
+
+def open_fasta(path):
+    """Open a plain or gzipped (including BGZF) FASTA file in binary mode"""
+    with open(path, "rb") as handle:
+        magic = handle.read(2)
+    return gzip.open(path, "rb") if magic == b"\x1f\x8b" else open(path, "rb")
+
+
+def header_id(line):
+    """Return the ID (first word after '>') of a FASTA header line as str"""
+    words = line[1:].split(None, 1)
+    return words[0].decode() if words else ""
+
+
+def find_fai(path):
+    """Return the path of an up to date samtools (.fai) or seqkit (.seqkit.fai) index of `path`, if any"""
+    for fai in (path + ".fai", path + ".seqkit.fai"):
+        if os.path.isfile(fai) and os.path.getmtime(fai) >= os.path.getmtime(path):
+            return fai
+    return None
+
+
+def read_fai(fai):
+    """Yield (id, length) from a FASTA index"""
+    with open(fai) as handle:
+        for line in handle:
+            fields = line.rstrip("\n").split("\t")
+            yield fields[0].split()[0], int(fields[1])
+
+
+def fasta_lengths(path, use_index=True):
+    """Yield (id, length) for each record of a FASTA file, in file order
+
+    Lengths are read from a .fai index when one is present, otherwise residues are counted line by
+    line without building the sequence strings.
+    """
+    fai = find_fai(path) if use_index else None
+    if fai:
+        yield from read_fai(fai)
+        return
+    with open_fasta(path) as handle:
+        id, length = None, 0
+        for line in handle:
+            if line[:1] == b">":
+                if id is not None:
+                    yield id, length
+                id, length = header_id(line), 0
+            else:
+                length += len(line.rstrip())
+        if id is not None:
+            yield id, length
+
+
+def fasta_ids(path, use_index=True):
+    """Yield the ID of each record of a FASTA file, in file order"""
+    fai = find_fai(path) if use_index else None
+    if fai:
+        for id, length in read_fai(fai):
+            yield id
+        return
+    with open_fasta(path) as handle:
+        for line in handle:
+            if line[:1] == b">":
+                yield header_id(line)
+
+
+def record_id(title):
+    """Return the ID (first word) of a record title as str"""
+    return title_id(title).decode()
+
+
+def read_record_blocks(handle, block_size=1 << 22):
+    """Yield the raw bytes of each record (from after its '>' to the next record) of a binary FASTA handle"""
+    # a newline is prepended to each read so headers split across reads are found; text before the first
+    # header is yielded first and discarded
+    pending, last, first = [], b"\n", True
+    while True:
+        data = handle.read(block_size)
+        if not data:
+            break
+        pieces = (last + data).split(b"\n>")
+        last = data[-1:]
+        pending.append(pieces[0][1:])
+        for piece in pieces[1:]:
+            if not first:
+                yield b"".join(pending)
+            pending, first = [piece], False
+    if not first:
+        yield b"".join(pending)
+
+
+def read_records(path):
+    """Yield (title, block) of each record of a plain or gzipped FASTA file, in file order"""
+    with open_fasta(path) as handle:
+        for record in read_record_blocks(handle):
+            title, _, block = record.partition(b"\n")
+            yield title.rstrip(), block.rstrip()
+
+
+def title_id(title):
+    """Return the ID (first word) of a record title as bytes"""
+    words = title.split(None, 1)
+    return words[0] if words else b""
+
+
+def select_records(records, ids, unique=False):
+    """Yield records whose ID is in `ids`, only the first record of each ID if `unique`"""
+    # compare raw IDs so titles are never decoded; non-string IDs, e.g. numbers read by pandas, match their str()
+    ids = set([_ if isinstance(_, bytes) else str(_).encode() for _ in ids])
+    seen = set()
+    for title, block in records:
+        id = title_id(title)
+        if id not in ids or id in seen:
+            continue
+        if unique:
+            seen.add(id)
+        yield title, block
+
+
+def rename_title(title, new_id):
+    """Return the title Bio.SeqIO.write gives a parsed record after its ID is set to `new_id`"""
+    new_id = new_id.encode()
+    if title and title.split(None, 1)[0] == new_id:
+        return title
+    return new_id + b" " + title if title else new_id
+
+
+def rename_records(records, rename):
+    """Yield records with their ID replaced by `rename(id)`"""
+    for title, block in records:
+        yield rename_title(title, rename(record_id(title))), block
+
+
+def prefix_records(records, prefix, sep="|"):
+    """Yield records with their ID prefixed by `prefix` and `sep`, rewriting the raw title like rename_title"""
+    prefix = (prefix + sep).encode()
+    for title, block in records:
+        yield (prefix + title_id(title) + b" " + title if title else prefix), block
+
+
+def has_layout(block, wrap):
+    """Return whether sequence lines are `wrap` residues long, except the last one, with no other whitespace"""
+    if b" " in block or b"\r" in block:
+        return False
+    num_lines = block.count(b"\n")
+    length = len(block) - num_lines
+    return num_lines == (length - 1) // wrap and block[wrap :: wrap + 1] == b"\n" * num_lines
+
+
+def open_output(path, bgzip=False):
+    """Open a FASTA output file in binary mode, BGZF or gzip compressed if it ends with .gz"""
+    if path.endswith(".gz") and bgzip:
+        # Biopython is only needed for BGZF output
+        from Bio import bgzf
+
+        return bgzf.BgzfWriter(path, "wb")
+    elif path.endswith(".gz"):
+        return gzip.open(path, "wb", compresslevel=6)
+    return open(path, "wb")
+
+
+def format_record(title, block, wrap=60):
+    """Return a record as FASTA bytes, re-wrapping sequences whose lines don't have the output layout"""
+    if wrap and block and not has_layout(block, wrap):
+        sequence = block.translate(None, b"\r\n ")
+        block = b"\n".join([sequence[i : i + wrap] for i in range(0, len(sequence), wrap)])
+    return b">" + title + b"\n" + block + b"\n" if block else b">" + title + b"\n"
+
+
+def write_records(records, path, wrap=60, bgzip=False):
+    """Write records to a FASTA file as they are yielded, returning the number of records written"""
+    count = 0
+    with open_output(path, bgzip) as handle:
+        for title, block in records:
+            handle.write(format_record(title, block, wrap))
+            count += 1
+    return count
+
+
+def build_record_store(records, path, index, wrap=60):
+    """Write records to a BGZF FASTA file and an SQLite index of the virtual offset and size of each ID
+
+    Only the first record of each ID is indexed. Returns the number of records written.
+    """
+    import sqlite3
+
+    from Bio import bgzf
+
+    count = 0
+    connection = sqlite3.connect(index)
+    connection.execute("DROP TABLE IF EXISTS records")
+    connection.execute("CREATE TABLE records (id TEXT PRIMARY KEY, offset INTEGER, size INTEGER) WITHOUT ROWID")
+    with bgzf.BgzfWriter(path, "wb") as handle:
+        rows = []
+        for title, block in records:
+            record = format_record(title, block, wrap)
+            rows.append((record_id(title), handle.tell(), len(record)))
+            handle.write(record)
+            count += 1
+            if len(rows) >= 100000:
+                connection.executemany("INSERT OR IGNORE INTO records VALUES (?, ?, ?)", rows)
+                rows = []
+        connection.executemany("INSERT OR IGNORE INTO records VALUES (?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+    return count
+
+
+def fetch_records(path, index, ids):
+    """Yield (title, block) of the records of `ids` in a record store, in file order, by random access"""
+    import sqlite3
+
+    from Bio import bgzf
+
+    ids = list(set(ids))
+    locations = []
+    connection = sqlite3.connect(index)
+    # stay below SQLite's default limit of host parameters per statement
+    for i in range(0, len(ids), 900):
+        batch = ids[i : i + 900]
+        query = "SELECT offset, size FROM records WHERE id IN (%s)" % ",".join(["?"] * len(batch))
+        locations.extend(connection.execute(query, batch).fetchall())
+    connection.close()
+    with bgzf.BgzfReader(path, "rb") as handle:
+        for offset, size in sorted(locations):
+            handle.seek(offset)
+            title, _, block = handle.read(size)[1:].partition(b"\n")
+            yield title, block.rstrip()
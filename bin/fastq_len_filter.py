@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
-import os
-from Bio import SeqIO
 import argparse as ap
-import sys
+import collections
+import contextlib
+import itertools
+import multiprocessing
 import os
+import sys
+from functools import partial
+
 import numpy as np
+from decompress import open_decompressed
 
 
 def read_params(args):
@@ -14,74 +19,154 @@ def read_params(args):
     p.add_argument("--min_qual", default=0, type=int)
     p.add_argument("--no_anonim", action="store_true")
     p.add_argument("--count")
-    p.add_argument("-i", "--input", required=True, help="Input File (FASTQ)")
-    p.add_argument("-o", "--output", required=True, help="Output File (FASTQ)")
+    p.add_argument("-t", "--threads", default=1, type=int, help="Number of processes filtering chunks of reads")
+    p.add_argument("-i", "--input", required=True, nargs="+", help="Input File(s) (FASTQ), filtered as if concatenated")
+    p.add_argument("-o", "--output", required=True, help="Output File (FASTQ, gzipped at a fast level if it ends with .gz)")
 
     return vars(p.parse_args())
 
 
 screenQual = range(20, 31)
-qualCounter = dict((k, 0) for k in screenQual)
 
-counter = 0
-allCounter = 0
-rpl = []
+
+def read_lines(paths, threads=1):
+    """Yield the raw lines of each file in turn, as if the files were concatenated"""
+    for path in paths:
+        with open_decompressed(path, threads) as f:
+            yield from f
+
+
+def read_fastq_chunks(lines, chunk_size=100000):
+    """Yield lists of the raw lines of up to `chunk_size` four-line FASTQ records"""
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, 4 * chunk_size))
+        if not chunk:
+            return
+        if len(chunk) % 4 or not all([line[:1] == b"@" for line in chunk[0::4]]):
+            raise ValueError("Input is not a four-line FASTQ file")
+        yield chunk
+
+
+def mean_qualities(quals):
+    """Return the mean Phred score of each quality string, NaN for empty ones"""
+    lengths = np.array([len(q) for q in quals], dtype=np.int64)
+    buffer = np.frombuffer(b"".join(quals), dtype=np.uint8)
+    # sums are exact integers, so the means equal np.mean over each read's scores
+    sums = np.concatenate([[0], np.cumsum(buffer, dtype=np.int64)])
+    ends = np.cumsum(lengths)
+    with np.errstate(invalid="ignore"):
+        return (sums[ends] - sums[ends - lengths] - 33 * lengths) / lengths
+
+
+def anonymized_title(title, index):
+    # same title as Bio.SeqIO.write after appending _<index> to the record ID
+    words = title.split(None, 1)
+    id = words[0] if words else b""
+    return id + b"_" + str(index).encode() + (b" " + title if title else b"")
+
+
+def filter_chunk(indexed_chunk, min_len, min_qual=0, no_anonim=False):
+    """Filter the reads of a (chunk, index of its first read in the input) pair
+
+    Returns (passed reads as FASTQ bytes, passed reads, reads, passed reads with mean quality >= each screenQual).
+    """
+    chunk, first_index = indexed_chunk
+    titles = [line[1:].rstrip() for line in chunk[0::4]]
+    seqs = [line.rstrip() for line in chunk[1::4]]
+    quals = [line.rstrip() for line in chunk[3::4]]
+    avQual = mean_qualities(quals)
+    lengths = np.array([len(s) for s in seqs], dtype=np.int64)
+    with np.errstate(invalid="ignore"):
+        passed = (avQual >= min_qual) & (lengths >= min_len)
+
+    records = []
+    for i in np.flatnonzero(passed).tolist():
+        title = titles[i] if no_anonim else anonymized_title(titles[i], first_index + i)
+        records.append(b"@" + title + b"\n" + seqs[i] + b"\n+\n" + quals[i] + b"\n")
+    histogram = [int(np.count_nonzero(avQual[passed] >= qu)) for qu in screenQual]
+    return b"".join(records), len(records), len(titles), histogram
+
+
+def indexed_chunks(chunks):
+    """Yield (chunk, index of its first read) pairs"""
+    first_index = 0
+    for chunk in chunks:
+        yield chunk, first_index
+        first_index += len(chunk) // 4
+
+
+def imap_bounded(pool, function, iterable, in_flight):
+    """Yield function(item) for each item of `iterable` in order, computed in `pool` with at most `in_flight` pending
+
+    Unlike Pool.imap, items are submitted from the calling thread, so input is not read ahead and errors
+    reading it or raised by a worker propagate to the caller.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def open_output(path):
+    """Open the filtered FASTQ in binary mode, gzipped at a fast level if it ends with .gz"""
+    if path.endswith(".gz"):
+        import gzip
+
+        return gzip.open(path, "wb", compresslevel=1)
+    return open(path, "wb")
+
+
+def fastq_len_filter(inputs, output, min_len, min_qual=0, no_anonim=False, threads=1):
+    """Write reads of `inputs` with at least `min_len` bases and mean quality `min_qual`, returning the read counts
+
+    With several threads, chunks are filtered in a process pool and written in input order. Returns
+    (passed reads, total reads, {quality: passed reads with at least that mean quality}).
+    """
+    counter, allCounter = 0, 0
+    qualCounter = dict((k, 0) for k in screenQual)
+    filter_reads = partial(filter_chunk, min_len=min_len, min_qual=min_qual, no_anonim=no_anonim)
+    with open_output(output) as outf, contextlib.ExitStack() as stack:
+        chunks = indexed_chunks(read_fastq_chunks(read_lines(inputs, threads)))
+        if threads > 1:
+            # leaving the pool terminates the workers, also when reading or filtering a chunk fails
+            pool = stack.enter_context(multiprocessing.Pool(threads))
+            # bound the chunks in flight to keep memory flat
+            results = imap_bounded(pool, filter_reads, chunks, 2 * threads)
+        else:
+            results = map(filter_reads, chunks)
+
+        for records, passed, reads, histogram in results:
+            outf.write(records)
+            counter += passed
+            allCounter += reads
+            for qu, count in zip(screenQual, histogram):
+                qualCounter[qu] += count
+    return counter, allCounter, qualCounter
 
 
 if __name__ == "__main__":
     args = read_params(sys.argv)
 
-    if not os.path.isfile(args["input"]):
-        print("Error: file " + args["input"] + " is not accessible!")
-        sys.exit(1)
-
-    if args["input"].endswith(".gz"):
-        import gzip
-        from functools import partial
-
-        _open = partial(gzip.open, mode="rt")
-    elif args["input"].endswith(".bz2"):
-        import bz2
-        from functools import partial
-
-        _open = partial(bz2.open, mode="rt")
-    else:
-        _open = open
-
-    min_len = args["min_len"]
-    with open(args["output"], "w") as outf:
-        with _open(args["input"]) as f:
-            for r in SeqIO.parse(f, "fastq"):
-                avQual = np.mean(r.letter_annotations["phred_quality"])
-
-                if avQual >= args["min_qual"] and len(r) >= min_len:
-                    if not args["no_anonim"]:
-                        r.id = r.id + "_" + str(allCounter)
-
-                    counter += 1
-                    rpl.append(r)
-
-                    for qu in screenQual:
-                        if avQual >= qu:
-                            qualCounter[qu] += 1
-
-                    if len(rpl) % 30000 == 0:
-                        SeqIO.write(rpl, outf, "fastq")
-                        rpl = []
-
-                allCounter += 1
-
-            if len(rpl) > 0:
-                SeqIO.write(rpl, outf, "fastq")
-                rpl = []
-
-            if args["count"]:
-                outCount = open(args["count"], "w")
-                outCount.write(
-                    str(counter)
-                    + "\t"
-                    + str(allCounter)
-                    + "\t"
-                    + "\t".join([str(ke) + ":" + str(val) for ke, val in qualCounter.items()])
-                )
-                outCount.close()
+    for input in args["input"]:
+        if not os.path.isfile(input):
+            print("Error: file " + input + " is not accessible!")
+            sys.exit(1)
+
+    counter, allCounter, qualCounter = fastq_len_filter(
+        args["input"], args["output"], args["min_len"], args["min_qual"], args["no_anonim"], args["threads"]
+    )
+
+    if args["count"]:
+        outCount = open(args["count"], "w")
+        outCount.write(
+            str(counter)
+            + "\t"
+            + str(allCounter)
+            + "\t"
+            + "\t".join([str(ke) + ":" + str(val) for ke, val in qualCounter.items()])
+        )
+        outCount.close()
@@ -1,12 +1,16 @@
 #!/usr/bin/env python
 
 import argparse
+import itertools
+import multiprocessing
+import numpy as np
 import pandas as pd
-from Bio import SeqIO
+import re
 import sys
-import gzip
 import os
 
+from fasta_io import read_records, record_id, rename_title, select_records, write_records
+
 
 def parse_args(args=None):
     Description = "Filter virus sequence based on CheckV output"
@@ -16,17 +20,20 @@ def parse_args(args=None):
     parser.add_argument(
         "-v",
         "--viruses",
-        help="Path to viruses FASTA (gzipped) file output by CheckV.",
+        nargs="+",
+        help="Path to viruses FASTA (gzipped) file output by CheckV, one per quality summary.",
     )
     parser.add_argument(
         "-p",
         "--proviruses",
-        help="Path to proviruses FASTA (gzipped) file output by CheckV.",
+        nargs="+",
+        help="Path to proviruses FASTA (gzipped) file output by CheckV, one per quality summary.",
     )
     parser.add_argument(
         "-q",
         "--quality_summary",
-        help="Path to quality summary TSV file output by CheckV.",
+        nargs="+",
+        help="Path to quality summary TSV file output by CheckV. Several samples can be filtered into one output by passing their quality summaries, viruses and proviruses in the same order.",
     )
     parser.add_argument(
         "-l",
@@ -55,93 +62,193 @@ def parse_args(args=None):
     parser.add_argument(
         "-o",
         "--output",
-        help="Output FASTA file containing filtered viral sequences.",
+        help="Output FASTA file containing filtered viral sequences (gzipped if it ends with .gz).",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        help="Path to a headerless TSV file with viruses, proviruses, quality summary and output paths for one sample per line. Each sample is filtered to its own output, replacing --viruses, --proviruses, --quality_summary and --output.",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of manifest samples filtered in parallel.",
+    )
+    parser.add_argument(
+        "--provirus_coordinates",
+        help="Also write the ID, contig, geNomad start and CheckV start/stop of each provirus to <output>.provirus_coordinates.tsv (output FASTA extension replaced).",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--bgzip",
+        help="Compress the output with BGZF instead of gzip, so it can be indexed with samtools faidx.",
+        action="store_true",
     )
     return parser.parse_args(args)
 
 
-def quality_filter_viruses(
-    viruses, proviruses, quality_summary, min_length, min_completeness, remove_proviruses, remove_warnings, output
-):
-    if os.stat(quality_summary).st_size != 0:
-        quality_summary_df = pd.read_csv(quality_summary, sep="\t")
+# CheckV provirus header, e.g. "k141_5|provirus_1001_9000_1 100-2000/8000": the contig ID (including any
+# geNomad provirus suffix) and CheckV's provirus index, then CheckV's provirus coordinates on that contig
+PROVIRUS_HEADER = re.compile(
+    rb"(?P<id>(?P<contig>\S*?(?:\|provirus_(?P<genomad_start>\d+)_\d+)?)_\d+)"
+    rb" (?P<checkv_start>\d+)-(?P<checkv_stop>\d+)/"
+)
+
+PROVIRUS_COORDINATES_COLUMNS = ["provirus_id", "contig", "genomad_start", "checkv_start", "checkv_stop"]
+
+
+def provirus_records(proviruses, filtered_viruses, coordinates=None):
+    """Yield provirus records of filtered viruses, with CheckV provirus coordinates appended to their ID
+
+    Coordinates are relative to the sequence before geNomad provirus extraction. When `coordinates` is a
+    handle, a PROVIRUS_COORDINATES_COLUMNS row is written to it for each record.
+    """
+    for title, block in read_records(proviruses):
+        header = PROVIRUS_HEADER.match(title)
+        if header is None:
+            if record_id(title).rpartition("_")[0] in filtered_viruses:
+                raise ValueError("Unexpected CheckV provirus header: %s" % title.decode())
+            continue
+        contig = header.group("contig").decode()
+        if contig not in filtered_viruses:
+            continue
+        genomad_start = int(header.group("genomad_start") or 1)
+        checkv_start_total = int(header.group("checkv_start")) + genomad_start - 1
+        checkv_stop_total = int(header.group("checkv_stop")) + genomad_start - 1
+        record_name = "%s|checkv_provirus_%s_%s" % (header.group("id").decode(), checkv_start_total, checkv_stop_total)
+        if coordinates is not None:
+            genomad = header.group("genomad_start").decode() if header.group("genomad_start") else ""
+            coordinates.write(
+                "\t".join([record_name, contig, genomad, str(checkv_start_total), str(checkv_stop_total)]) + "\n"
+            )
+        yield rename_title(title, record_name), block
+
+
+def coordinates_path(output):
+    """Return the provirus coordinates TSV path for an output FASTA, e.g. test.filtered.fna.gz -> test.filtered.provirus_coordinates.tsv"""
+    root = output[:-3] if output.endswith(".gz") else output
+    return os.path.splitext(root)[0] + ".provirus_coordinates.tsv"
+
+
+# columns of the CheckV quality summary used for filtering, and their types
+QUALITY_SUMMARY_DTYPES = {
+    "contig_id": str,
+    "contig_length": float,
+    "provirus": "category",
+    "proviral_length": float,
+    "completeness": float,
+    "warnings": str,
+}
+
+
+def filter_quality_summary(quality_summary, min_length, min_completeness, remove_proviruses, remove_warnings):
+    """Return the set of contig IDs in a CheckV quality summary that pass filtering"""
+    if os.stat(quality_summary).st_size == 0:
+        return set()
+    quality_summary_df = pd.read_csv(
+        quality_summary, sep="\t", usecols=list(QUALITY_SUMMARY_DTYPES), dtype=QUALITY_SUMMARY_DTYPES
+    )
 
-        quality_summary_df["length"] = quality_summary_df.apply(
-            lambda x: x.proviral_length if x.proviral_length > 0 else x.contig_length, axis=1
-        )
+    # proviruses are filtered on their proviral length, other viruses on their contig length
+    proviral_length = quality_summary_df["proviral_length"].to_numpy()
+    length = np.where(proviral_length > 0, proviral_length, quality_summary_df["contig_length"].to_numpy())
+    passed = (length >= float(min_length)) | (quality_summary_df["completeness"].to_numpy() >= float(min_completeness))
+
+    if remove_proviruses:
+        passed &= (quality_summary_df["provirus"] != "Yes").to_numpy()
+
+    # remove genomes > 1.5x longer than expected
+    warnings = quality_summary_df["warnings"]
+    if remove_warnings and (passed & warnings.notnull().to_numpy()).sum() > 1:
+        too_long = warnings.str.contains("contig >1.5x longer than expected genome length", regex=False)
+        passed &= ~too_long.fillna(False).to_numpy(dtype=bool)
 
-        quality_summary_filtered = quality_summary_df[
-            (quality_summary_df["length"] >= float(min_length))
-            | (quality_summary_df["completeness"] >= float(min_completeness))
-        ]
-
-        if remove_proviruses:
-            quality_summary_filtered = quality_summary_filtered[(quality_summary_filtered["provirus"] != "Yes")]
-
-        # remove genomes > 1.5x longer than expected
-        if len(quality_summary_filtered[quality_summary_filtered["warnings"].notnull()]) > 1 and remove_warnings:
-            quality_summary_filtered = quality_summary_filtered[
-                (
-                    quality_summary_filtered["warnings"].str.contains("contig >1.5x longer than expected genome length")
-                    == False
-                )
-                | (quality_summary_filtered["warnings"].isnull())
-            ]
-
-        filtered_viruses = set(quality_summary_filtered["contig_id"])
-        filtered_virus_seqs = []
-
-        # parse through and combine virus sequences for each sample
-        with gzip.open(viruses, "rt") as viruses_gunzip:
-            for record in SeqIO.parse(viruses_gunzip, "fasta"):
-                if record.id in filtered_viruses:
-                    filtered_virus_seqs.append(record)
-
-        with gzip.open(proviruses, "rt") as proviruses_gunzip:
-            for record in SeqIO.parse(proviruses_gunzip, "fasta"):
-                if record.id.rpartition("_")[0] in filtered_viruses:
-                    if "|provirus" in record.id:
-                        genomad_provirus = record.id.split("|provirus")[1]
-                        genomad_start = genomad_provirus.split("_")[1]
-                        checkv_provirus = record.description.split(" ")[1]
-                        checkv_provirus_coords = checkv_provirus.split("/")[0]
-                        checkv_start, checkv_stop = checkv_provirus_coords.split("-")
-                        checkv_start_total = int(checkv_start) + int(genomad_start) - 1
-                        checkv_stop_total = int(checkv_stop) + int(genomad_start) - 1
-                        record.id = (
-                            record.id + "|checkv_provirus_" + str(checkv_start_total) + "_" + str(checkv_stop_total)
-                        )
-                    else:
-                        checkv_provirus = record.description.split(" ")[1]
-                        checkv_provirus_coords = checkv_provirus.split("/")[0]
-                        checkv_start, checkv_stop = checkv_provirus_coords.split("-")
-                        checkv_start_total = int(checkv_start)
-                        checkv_stop_total = int(checkv_stop)
-                        record.id = (
-                            record.id + "|checkv_provirus_" + str(checkv_start_total) + "_" + str(checkv_stop_total)
-                        )
-                    filtered_virus_seqs.append(record)
-
-        # save all sequences to specified file
-        SeqIO.write(filtered_virus_seqs, output, "fasta")
+    return set(quality_summary_df["contig_id"][passed])
 
+
+def quality_filter_viruses(
+    viruses,
+    proviruses,
+    quality_summaries,
+    min_length,
+    min_completeness,
+    remove_proviruses,
+    remove_warnings,
+    output,
+    bgzip=False,
+    provirus_coordinates=False,
+):
+    coordinates = open(coordinates_path(output), "w") if provirus_coordinates else None
+    if coordinates is not None:
+        coordinates.write("\t".join(PROVIRUS_COORDINATES_COLUMNS) + "\n")
+
+    # filter each sample's sequences with its own quality summary, as contig IDs may repeat across samples
+    filtered_virus_seqs = []
+    for sample_viruses, sample_proviruses, quality_summary in zip(viruses, proviruses, quality_summaries):
+        filtered_viruses = filter_quality_summary(
+            quality_summary, min_length, min_completeness, remove_proviruses, remove_warnings
+        )
+        if not filtered_viruses:
+            continue
+
+        # stream virus and then provirus sequences that passed filtering straight to the output
+        filtered_virus_seqs.append(select_records(read_records(sample_viruses), filtered_viruses))
+        filtered_virus_seqs.append(provirus_records(sample_proviruses, filtered_viruses, coordinates))
+
+    write_records(itertools.chain(*filtered_virus_seqs), output, bgzip=bgzip)
+    if coordinates is not None:
+        coordinates.close()
+
+
+def read_manifest(manifest):
+    """Return (viruses, proviruses, quality_summary, output) of each sample in a manifest"""
+    samples = []
+    with open(manifest, "r") as handle:
+        for line in handle:
+            if line.strip():
+                viruses, proviruses, quality_summary, output = line.rstrip("\n").split("\t")
+                samples.append((viruses, proviruses, quality_summary, output))
+    return samples
+
+
+def quality_filter_sample(job):
+    """Filter one manifest sample, returning its output path"""
+    (viruses, proviruses, quality_summary, output), options = job
+    quality_filter_viruses([viruses], [proviruses], [quality_summary], output=output, **options)
+    return output
+
+
+def quality_filter_manifest(manifest, threads, **options):
+    jobs = [(sample, options) for sample in read_manifest(manifest)]
+    if threads > 1 and len(jobs) > 1:
+        # one pandas import and process start for the whole batch, samples are independent
+        with multiprocessing.Pool(min(threads, len(jobs))) as pool:
+            list(pool.imap_unordered(quality_filter_sample, jobs))
     else:
-        output = open(output, "x")
-        output.close()
+        for job in jobs:
+            quality_filter_sample(job)
 
 
 def main(args=None):
     args = parse_args(args)
-    quality_filter_viruses(
-        args.viruses,
-        args.proviruses,
-        args.quality_summary,
-        args.min_length,
-        args.min_completeness,
-        args.remove_proviruses,
-        args.remove_warnings,
-        args.output,
-    )
+    options = {
+        "min_length": args.min_length,
+        "min_completeness": args.min_completeness,
+        "remove_proviruses": args.remove_proviruses,
+        "remove_warnings": args.remove_warnings,
+        "bgzip": args.bgzip,
+        "provirus_coordinates": args.provirus_coordinates,
+    }
+    if args.manifest:
+        quality_filter_manifest(args.manifest, args.threads, **options)
+        return
+    if not args.viruses or not args.proviruses or not args.quality_summary or not args.output:
+        sys.exit("Either --manifest, or --viruses, --proviruses, --quality_summary and --output must be provided.")
+    if not len(args.viruses) == len(args.proviruses) == len(args.quality_summary):
+        sys.exit("The same number of --viruses, --proviruses and --quality_summary files must be provided.")
+    quality_filter_viruses(args.viruses, args.proviruses, args.quality_summary, output=args.output, **options)
 
 
 if __name__ == "__main__":
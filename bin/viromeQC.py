@@ -5,6 +5,7 @@ import argparse
 import zipfile
 import time
 import tempfile
+import signal
 import subprocess
 import pandas as pd
 
@@ -207,6 +208,119 @@ def no_fq_extension(string):
     return ".".join(z)
 
 
+class Pipeline:
+    """Processes piped one into the next, the last one writing a read count to stdout"""
+
+    def __init__(self, commands, stderr=None):
+        self.processes = []
+        try:
+            for command in commands:
+                stdin = self.processes[-1].stdout if self.processes else None
+                shell = isinstance(command, str)
+                self.processes.append(
+                    subprocess.Popen(command, shell=shell, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr)
+                )
+                if stdin is not None:
+                    # only the next process reads it, so a failing reader is seen upstream as a broken pipe
+                    stdin.close()
+        except Exception:
+            self.kill()
+            raise
+
+    def count(self):
+        """Wait for the pipeline and return its count, raising CalledProcessError if any process failed"""
+        output = self.processes[-1].communicate()[0]
+        failed = [process for process in self.processes if process.wait() != 0]
+        if failed:
+            # report the failing process rather than the writers it left with a broken pipe
+            causes = [process for process in failed if process.returncode != -signal.SIGPIPE]
+            process = (causes or failed)[0]
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+        return int(output)
+
+    def kill(self):
+        """Kill the processes still running"""
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+
+def count_rrna_reads(reads, index, minlen, threads, debug=False):
+    """Start counting the reads aligned by bowtie2 to an rRNA index and passing cmseq_filter.py"""
+    bt2_command = [
+        "bowtie2",
+        "--quiet",
+        "-p",
+        str(threads),
+        "--very-sensitive-local",
+        "-x",
+        index,
+        "--no-unal",
+        "-U",
+        reads,
+        "-S",
+        "-",
+    ]
+    if debug:
+        print(" ".join(bt2_command))
+    return Pipeline(
+        [
+            bt2_command,
+            [CHECKER_PATH + "/cmseq_filter.py", "--minlen", minlen, "--minqual", "20", "--maxsnps", "0.075"],
+            ["samtools", "view", "-"],
+            ["wc", "-l"],
+        ]
+    )
+
+
+def count_marker_reads(reads, db, threads, diamond_path="diamond", debug=False):
+    """Start counting the reads aligned by diamond blastx to the single-copy marker database"""
+    diamond_command = [
+        diamond_path,
+        "blastx",
+        "-q",
+        reads,
+        "--threads",
+        str(threads),
+        "--outfmt",
+        "6",
+        "--db",
+        db,
+        "--id",
+        "50",
+        "--max-hsps",
+        "35",
+        "-k",
+        "0",
+        "--quiet",
+    ]
+    if debug:
+        return Pipeline([diamond_command, "cut -f1 | sort | uniq | wc -l"])
+    with open(os.devnull, "w") as devnull:
+        return Pipeline([diamond_command, "cut -f1 | sort | uniq | wc -l"], stderr=devnull)
+
+
+def kill_stages(stages):
+    """Stop the alignments still running when a stage failed"""
+    for stage in stages or []:
+        stage.kill()
+
+
+# rough relative run times of the SSU, LSU and marker alignments, used to share threads between them
+STAGE_WEIGHTS = (2, 1, 2)
+
+
+def share_threads(threads, weights=STAGE_WEIGHTS):
+    """Split a thread budget between stages by their weights, at least one thread each"""
+    shares = [1] * len(weights)
+    for _ in range(threads - len(weights)):
+        # the next thread goes to the stage with the most work per thread
+        stage = max(range(len(weights)), key=lambda i: float(weights[i]) / shares[i])
+        shares[stage] += 1
+    return shares
+
+
 try:
     from Bio import SeqIO
     from Bio.Seq import Seq
@@ -292,6 +406,21 @@ parser.add_argument("--index_dir", help="Path where indexes should be stored", d
 parser.add_argument("--zenodo", help="Use Zenodo instead of Dropbox to download the DB", action="store_true")
 parser.add_argument("--sample_name", help="Optional label for the sample to be included in the output file")
 parser.add_argument("--tempdir", help="Temporary Directory override (default is the system temp directory)")
+parser.add_argument(
+    "--concurrent_stages",
+    help="Run the SSU, LSU and marker alignments at the same time, sharing --threads between them",
+    action="store_true",
+)
+parser.add_argument(
+    "--threads",
+    type=int,
+    help="Number of threads shared by the concurrent alignments (default: the larger of --bowtie2_threads and --diamond_threads)",
+)
+parser.add_argument(
+    "--compress_filtered",
+    help="Write the filtered reads read by bowtie2 and diamond gzipped at a fast level, to reduce temporary disk usage",
+    action="store_true",
+)
 
 
 args = parser.parse_args()
@@ -355,32 +484,17 @@ except Exception as e:
     fancy_print("Could not create temp folder in " + str(tempfile.tempdir), "FAIL", bcolors.FAIL)
     sys.exit(1)
 
+# multiple inputs are streamed into fastq_len_filter one after the other, without a merged copy
 if len(args.input) > 1:
-    fancy_print("Merging " + str(len(args.input)) + " files", "...", bcolors.OKBLUE, reline=True)
-    with open(tmpdirname + "/combined.fastq", "a") as combinedFastq:
-        for infile in args.input:
-            # print(['cat',infile,'>>',tmpdirname+'/combined.fastq'])
-            if infile.endswith(".gz"):
-                uncompression_cmd = "zcat"
-            elif infile.endswith(".bz2"):
-                uncompression_cmd = "bzcat"
-            else:
-                uncompression_cmd = "cat"
-
-            subprocess.check_call([uncompression_cmd, infile], stdout=combinedFastq)
-
-    inputFile = tmpdirname + "/combined.fastq"
+    fileName = "combined"
     workingName = (
         args.sample_name if args.sample_name else ",".join([no_fq_extension(os.path.basename(x)) for x in args.input])
     )
-
-    fancy_print("Merging " + str(len(args.input)) + " files", "DONE", bcolors.OKGREEN, reline=True, newLine=True)
 else:
-    inputFile = args.input[0]
-    workingName = args.sample_name if args.sample_name else no_fq_extension(os.path.basename(inputFile))
-
+    fileName = no_fq_extension(os.path.basename(args.input[0]))
+    workingName = args.sample_name if args.sample_name else fileName
 
-fileName = no_fq_extension(os.path.basename(inputFile))
+filteredFile = tmpdirname + "/" + fileName + (".filter.fastq.gz" if args.compress_filtered else ".filter.fastq")
 
 
 fastq_len_cmd = [
@@ -391,10 +505,12 @@ fastq_len_cmd = [
     args.minqual,
     "--count",
     tmpdirname + "/" + fileName + ".nreads",
+    "--threads",
+    args.bowtie2_threads,
     "-i",
-    inputFile,
+] + args.input + [
     "-o",
-    tmpdirname + "/" + fileName + ".filter.fastq",
+    filteredFile,
 ]
 try:
     fancy_print("[fastq_len_filter] | filtering HQ reads", "...", bcolors.OKBLUE, reline=True)
@@ -404,7 +520,6 @@ try:
     with open(tmpdirname + "/" + fileName + ".nreads") as readCounts:
         HQReads, totalReads = [line.strip().split("\t")[0:2] for line in readCounts][0]
 
-    filteredFile = tmpdirname + "/" + fileName + ".filter.fastq"
     fancy_print(
         "[fastq_len_filter] | "
         + HQReads
@@ -424,39 +539,66 @@ except Exception as e:
     sys.exit(1)
 
 
-try:
-    fancy_print("[SILVA_SSU]   | Bowtie2 Aligning", "...", bcolors.OKBLUE, reline=True)
+# the three alignments only read the filtered reads, so they can run at the same time
+concurrent_stages = None
+if args.concurrent_stages:
+    threads = args.threads or max(int(args.bowtie2_threads), int(args.diamond_threads))
+    if threads < len(STAGE_WEIGHTS):
+        fancy_print(
+            "Fewer threads ({}) than alignment stages, running them one after the other".format(threads),
+            "!!",
+            bcolors.WARNING,
+        )
+    else:
+        SSU_threads, LSU_threads, markers_threads = share_threads(threads)
+        concurrent_stages = []
+        try:
+            concurrent_stages.append(
+                count_rrna_reads(
+                    filteredFile,
+                    index_dir + "/SILVA_132_SSURef_Nr99_tax_silva.clean",
+                    args.minlen_SSU,
+                    SSU_threads,
+                    args.debug,
+                )
+            )
+            concurrent_stages.append(
+                count_rrna_reads(
+                    filteredFile,
+                    index_dir + "/SILVA_132_LSURef_tax_silva.clean",
+                    args.minlen_LSU,
+                    LSU_threads,
+                    args.debug,
+                )
+            )
+            concurrent_stages.append(
+                count_marker_reads(
+                    filteredFile,
+                    index_dir + "/" + req_dmd_db_filename,
+                    markers_threads,
+                    args.diamond_path,
+                    args.debug,
+                )
+            )
+        except Exception as e:
+            fancy_print("Fatal error starting the alignments. Error message: " + str(e), "FAIL", bcolors.FAIL)
+            kill_stages(concurrent_stages)
+            sys.exit(1)
 
-    bt2_command = [
-        "bowtie2",
-        "--quiet",
-        "-p",
-        args.bowtie2_threads,
-        "--very-sensitive-local",
-        "-x",
-        index_dir + "/SILVA_132_SSURef_Nr99_tax_silva.clean",
-        "--no-unal",
-        "-U",
-        filteredFile,
-        "-S",
-        "-",
-    ]
-    if args.debug:
-        print(" ".join(bt2_command))
-    p4 = subprocess.Popen(["wc", "-l"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    p3 = subprocess.Popen(["samtools", "view", "-"], stdin=subprocess.PIPE, stdout=p4.stdin)
-    p2 = subprocess.Popen(
-        [CHECKER_PATH + "/cmseq_filter.py", "--minlen", args.minlen_SSU, "--minqual", "20", "--maxsnps", "0.075"],
-        stdin=subprocess.PIPE,
-        stdout=p3.stdin,
-    )
-    p1 = subprocess.Popen(bt2_command, stdout=p2.stdin)
 
-    p1.wait()
-    p2.communicate()
-    p3.communicate()
+try:
+    fancy_print("[SILVA_SSU]   | Bowtie2 Aligning", "...", bcolors.OKBLUE, reline=True)
 
-    SSU_reads = int(p4.communicate()[0])
+    if concurrent_stages:
+        SSU_reads = concurrent_stages[0].count()
+    else:
+        SSU_reads = count_rrna_reads(
+            filteredFile,
+            index_dir + "/SILVA_132_SSURef_Nr99_tax_silva.clean",
+            args.minlen_SSU,
+            args.bowtie2_threads,
+            args.debug,
+        ).count()
     SSU_reads_rate = max(LIMIT_OF_DETECTION, float(SSU_reads) / float(HQReads) * 100)
     enrichment_SSU = min(
         100, float(medians.loc[medians["parameter"] == "rRNA_SSU", args.enrichment_preset]) / float(SSU_reads_rate)
@@ -483,44 +625,23 @@ try:
 
 except Exception as e:
     fancy_print("Fatal error running Bowtie2 on SSU rRNA. Error message: " + str(e), "FAIL", bcolors.FAIL)
+    kill_stages(concurrent_stages)
     sys.exit(1)
 
 
 try:
     fancy_print("[SILVA_LSU]   | Bowtie2 Aligning", "...", bcolors.OKBLUE, reline=True)
 
-    bt2_command = [
-        "bowtie2",
-        "--quiet",
-        "-p",
-        args.bowtie2_threads,
-        "--very-sensitive-local",
-        "-x",
-        index_dir + "/SILVA_132_LSURef_tax_silva.clean",
-        "--no-unal",
-        "-U",
-        filteredFile,
-        "-S",
-        "-",
-    ]
-    if args.debug:
-        print(" ".join(bt2_command))
-    # print("AAA")
-
-    p4 = subprocess.Popen(["wc", "-l"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    p3 = subprocess.Popen(["samtools", "view", "-"], stdin=subprocess.PIPE, stdout=p4.stdin)
-    p2 = subprocess.Popen(
-        [CHECKER_PATH + "/cmseq_filter.py", "--minlen", args.minlen_LSU, "--minqual", "20", "--maxsnps", "0.075"],
-        stdin=subprocess.PIPE,
-        stdout=p3.stdin,
-    )
-    p1 = subprocess.Popen(bt2_command, stdout=p2.stdin)
-
-    p1.wait()
-    p2.communicate()
-    p3.communicate()
-
-    LSU_reads = int(p4.communicate()[0])
+    if concurrent_stages:
+        LSU_reads = concurrent_stages[1].count()
+    else:
+        LSU_reads = count_rrna_reads(
+            filteredFile,
+            index_dir + "/SILVA_132_LSURef_tax_silva.clean",
+            args.minlen_LSU,
+            args.bowtie2_threads,
+            args.debug,
+        ).count()
     LSU_reads_rate = max(LIMIT_OF_DETECTION, float(LSU_reads) / float(HQReads) * 100)
 
     enrichment_LSU = min(
@@ -549,43 +670,23 @@ try:
 
 except Exception as e:
     fancy_print("Fatal error running Bowtie2 on LSU rRNA. Error message: " + str(e), "FAIL", bcolors.FAIL)
+    kill_stages(concurrent_stages)
     sys.exit(1)
 
 
 try:
     fancy_print("[SC-Markers]  | Diamond Aligning", "...", bcolors.OKBLUE, reline=True)
 
-    diamond_command = [
-        args.diamond_path,
-        "blastx",
-        "-q",
-        filteredFile,
-        "--threads",
-        args.diamond_threads,
-        "--outfmt",
-        "6",
-        "--db",
-        index_dir + "/" + req_dmd_db_filename,
-        "--id",
-        "50",
-        "--max-hsps",
-        "35",
-        "-k",
-        "0",
-        "--quiet",
-    ]
-    p2 = subprocess.Popen("cut -f1 | sort | uniq | wc -l", shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-
-    if args.debug:
-        p1 = subprocess.Popen(diamond_command, stdout=p2.stdin)
+    if concurrent_stages:
+        singleCopyMarkers_reads = concurrent_stages[2].count()
     else:
-        if args.debug:
-            p1 = subprocess.Popen(diamond_command, stdout=p2.stdin)
-        else:
-            with open(os.devnull) as devnull:
-                p1 = subprocess.Popen(diamond_command, stdout=p2.stdin, stderr=devnull)
-
-    singleCopyMarkers_reads = int(p2.communicate()[0])
+        singleCopyMarkers_reads = count_marker_reads(
+            filteredFile,
+            index_dir + "/" + req_dmd_db_filename,
+            args.diamond_threads,
+            args.diamond_path,
+            args.debug,
+        ).count()
     singleCopyMarkers_reads_rate = max(LIMIT_OF_DETECTION, float(singleCopyMarkers_reads) / float(HQReads) * 100)
 
     enrichment_singleCopyMarkers = min(
@@ -615,6 +716,7 @@ try:
 
 except Exception as e:
     fancy_print("Fatal error running Diamond on Single-Copy-Proteins. Error message: " + str(e), "FAIL", bcolors.FAIL)
+    kill_stages(concurrent_stages)
     sys.exit(1)
 
 overallEnrichmenScore = min(enrichment_SSU, enrichment_LSU, enrichment_singleCopyMarkers)
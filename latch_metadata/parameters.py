@@ -74,6 +74,12 @@ generated_parameters = {
         section_title=None,
         description='Save reference virus sketch, if it was created.',
     ),
+    'reference_virus_store': NextflowParameter(
+        type=typing.Optional[bool],
+        default=None,
+        section_title=None,
+        description="Index reference virus sequences once so each sample's mash screen hits are fetched by random access",
+    ),
     'mash_screen_min_score': NextflowParameter(
         type=typing.Optional[float],
         default=0.95,
@@ -86,6 +92,24 @@ generated_parameters = {
         section_title=None,
         description='Hashes present in multiple references are assigned only to top sequence',
     ),
+    'mash_screen_min_shared_hashes': NextflowParameter(
+        type=typing.Optional[float],
+        default=None,
+        section_title=None,
+        description="Minimum fraction of a reference's hashes shared with the reads for it to be appended to assemblies",
+    ),
+    'mash_screen_max_p_value': NextflowParameter(
+        type=typing.Optional[float],
+        default=None,
+        section_title=None,
+        description='Maximum mash screen p-value for a reference to be appended to assemblies',
+    ),
+    'mash_screen_split_sketches': NextflowParameter(
+        type=typing.Optional[bool],
+        default=None,
+        section_title=None,
+        description='Screen reads against the reference and assembly sketches separately instead of pasting them together for every sample',
+    ),
     'skip_genomad': NextflowParameter(
         type=typing.Optional[bool],
         default=None,
@@ -188,6 +212,18 @@ generated_parameters = {
         section_title=None,
         description='Remove viruses with CheckV warnings',
     ),
+    'checkv_provirus_coordinates': NextflowParameter(
+        type=typing.Optional[bool],
+        default=None,
+        section_title=None,
+        description='Publish a TSV with the contig, geNomad start and CheckV start/stop of each quality filtered provirus',
+    ),
+    'checkv_batch_size': NextflowParameter(
+        type=typing.Optional[int],
+        default=1,
+        section_title=None,
+        description='Number of samples quality filtered per task',
+    ),
     'skip_virus_clustering': NextflowParameter(
         type=typing.Optional[bool],
         default=None,
@@ -224,6 +260,30 @@ generated_parameters = {
         section_title=None,
         description='Minimum test coverage for sequences to be clustered together',
     ),
+    'anicluster_binary_ani': NextflowParameter(
+        type=typing.Optional[bool],
+        default=None,
+        section_title=None,
+        description='Pass ANI values from anicalc to aniclust as a binary table instead of TSV',
+    ),
+    'anicluster_extra_thresholds': NextflowParameter(
+        type=typing.Optional[str],
+        default=None,
+        section_title=None,
+        description="Additional ANI,QCOV,TCOV threshold sets to cluster at, separated by spaces (e.g. '97,0,90 99,0,95')",
+    ),
+    'anicluster_prev_clusters': NextflowParameter(
+        type=typing.Optional[LatchFile],
+        default=None,
+        section_title=None,
+        description='Path to clusters TSV from a previous run to extend with the new viruses',
+    ),
+    'anicluster_prev_reps': NextflowParameter(
+        type=typing.Optional[LatchFile],
+        default=None,
+        section_title=None,
+        description='Path to FASTA file containing the cluster representatives from a previous run',
+    ),
     'skip_read_alignment': NextflowParameter(
         type=typing.Optional[bool],
         default=None,
@@ -11,8 +11,8 @@ process ANICLUSTER_ANICALC {
     tuple val(meta), path(blast_txt)
 
     output:
-    tuple val(meta), path("*_ani.tsv")  , emit: ani
-    path "versions.yml"                 , emit: versions
+    tuple val(meta), path("*_ani.{tsv,npz}")    , emit: ani
+    path "versions.yml"                         , emit: versions
 
     when:
     task.ext.when == null || task.ext.when
@@ -20,10 +20,13 @@ process ANICLUSTER_ANICALC {
     script:
     def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
+    def suffix = task.ext.suffix ?: "tsv"
     """
     anicalc.py \\
         -i $blast_txt \\
-        -o ${prefix}_ani.tsv
+        -o ${prefix}_ani.${suffix} \\
+        --threads $task.cpus \\
+        $args
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
@@ -36,8 +39,9 @@ process ANICLUSTER_ANICALC {
     stub:
     def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
+    def suffix = task.ext.suffix ?: "tsv"
     """
-    touch ${prefix}_ani.tsv
+    touch ${prefix}_ani.${suffix}
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
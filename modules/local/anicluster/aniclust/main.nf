@@ -9,10 +9,12 @@ process ANICLUSTER_ANICLUST {
 
     input:
     tuple val(meta), path(fasta), path(ani)
+    path prev_clusters
 
     output:
-    tuple val(meta), path("*_clusters.tsv") , emit: clusters
-    path "versions.yml"                     , emit: versions
+    tuple val(meta), path("*_clusters.tsv")         , emit: clusters
+    path "versions.yml"                             , emit: versions
+    tuple val(meta), path("*_clusters_ani*.tsv")    , emit: extra_clusters  , optional: true
 
     when:
     task.ext.when == null || task.ext.when
@@ -20,11 +22,13 @@ process ANICLUSTER_ANICLUST {
     script:
     def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
+    def prev = prev_clusters ? "--prev_clusters ${prev_clusters}" : ""
     """
     aniclust.py \\
         --fna $fasta \\
         --ani $ani \\
         --out ${prefix}_clusters.tsv \\
+        $prev \\
         $args
 
     cat <<-END_VERSIONS > versions.yml
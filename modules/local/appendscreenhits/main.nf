@@ -9,7 +9,7 @@ process APPENDSCREENHITS {
 
     input:
     tuple val(meta), path(mash_screen),  path(assembly_fasta)
-    tuple val(meta2), path(reference_fasta)
+    tuple val(meta2), path(reference_fasta), path(reference_index)
 
     output:
     tuple val(meta), path("*.fasta_w_screen_hits.fna.gz")   , emit: assembly_w_screen_hits
@@ -21,15 +21,16 @@ process APPENDSCREENHITS {
     script:
     def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
+    def index = reference_index ? "--reference_index ${reference_index}" : ""
     """
     append_screen_hits.py \\
         --reference_fasta $reference_fasta \\
+        $index \\
         --mash_screen_results $mash_screen \\
         --assembly_fasta $assembly_fasta \\
         --prefix $prefix \\
-        --output ${prefix}.fasta_w_screen_hits.fna
-
-    gzip ${prefix}.fasta_w_screen_hits.fna
+        --output ${prefix}.fasta_w_screen_hits.fna.gz \\
+        $args
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
@@ -0,0 +1,50 @@
+process BUILDREFERENCESTORE {
+    tag "$meta.id"
+    label 'process_low'
+
+    conda "${moduleDir}/environment.yml"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/mulled-v2-80c23cbcd32e2891421c54d1899665046feb07ef:77a31e289d22068839533bf21f8c4248ad274b60-0' :
+        'biocontainers/mulled-v2-80c23cbcd32e2891421c54d1899665046feb07ef:77a31e289d22068839533bf21f8c4248ad274b60-0' }"
+
+    input:
+    tuple val(meta), path(reference_fasta)
+
+    output:
+    tuple val(meta), path("*.store.fna.gz"), path("*.store.fna.gz.sqlite")  , emit: store
+    path "versions.yml"                                                     , emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    """
+    build_reference_store.py \\
+        --reference_fasta $reference_fasta \\
+        --output ${prefix}.store.fna.gz \\
+        $args
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$( python --version | sed 's/Python //' )
+        biopython: \$(echo \$(biopython_version.py 2>&1))
+    END_VERSIONS
+    """
+
+    stub:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: "${meta.id}"
+    """
+    touch ${prefix}.store.fna
+    gzip ${prefix}.store.fna
+    touch ${prefix}.store.fna.gz.sqlite
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$( python --version | sed 's/Python //' )
+        biopython: \$(echo \$(biopython_version.py 2>&1))
+    END_VERSIONS
+    """
+}
@@ -11,8 +11,9 @@ process QUALITYFILTERVIRUSES {
     tuple val(meta), path(viruses), path(proviruses), path(quality_summary)
 
     output:
-    tuple val(meta), path("*.filtered.fna.gz")  , emit: filtered_viruses
-    path "versions.yml"                         , emit: versions
+    tuple val(meta), path("*.filtered.fna.gz")          , emit: filtered_viruses
+    path "versions.yml"                                 , emit: versions
+    tuple val(meta), path("*.provirus_coordinates.tsv") , emit: provirus_coordinates, optional: true
 
     when:
     task.ext.when == null || task.ext.when
@@ -25,11 +26,9 @@ process QUALITYFILTERVIRUSES {
         --viruses $viruses \\
         --proviruses $proviruses \\
         --quality_summary $quality_summary \\
-        --output ${prefix}.filtered.fna \\
+        --output ${prefix}.filtered.fna.gz \\
         $args
 
-    gzip ${prefix}.filtered.fna
-
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
         python: \$( python --version | sed 's/Python //' )
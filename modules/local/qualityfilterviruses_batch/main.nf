@@ -0,0 +1,58 @@
+process QUALITYFILTERVIRUSES_BATCH {
+    tag "${metas.size()} samples"
+    label 'process_medium'
+
+    conda "${moduleDir}/environment.yml"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/mulled-v2-80c23cbcd32e2891421c54d1899665046feb07ef:77a31e289d22068839533bf21f8c4248ad274b60-0' :
+        'biocontainers/mulled-v2-80c23cbcd32e2891421c54d1899665046feb07ef:77a31e289d22068839533bf21f8c4248ad274b60-0' }"
+
+    input:
+    tuple val(metas), path(viruses, stageAs: "viruses*/*"), path(proviruses, stageAs: "proviruses*/*"), path(quality_summaries, stageAs: "quality_summary*/*")
+
+    output:
+    tuple val(metas), path("*.filtered.fna.gz")          , emit: filtered_viruses
+    path "versions.yml"                                  , emit: versions
+    tuple val(metas), path("*.provirus_coordinates.tsv") , emit: provirus_coordinates, optional: true
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    // one manifest line per sample: viruses, proviruses, quality summary, output
+    def manifest = [ metas, [viruses].flatten(), [proviruses].flatten(), [quality_summaries].flatten() ]
+        .transpose()
+        .collect { meta, virus, provirus, quality_summary -> "${virus} ${provirus} ${quality_summary} ${meta.id}.filtered.fna.gz" }
+        .join(' ')
+    """
+    printf "%s\\t%s\\t%s\\t%s\\n" ${manifest} > manifest.tsv
+
+    quality_filter_viruses.py \\
+        --manifest manifest.tsv \\
+        --threads $task.cpus \\
+        $args
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$( python --version | sed 's/Python //' )
+        biopython: \$(echo \$(biopython_version.py 2>&1))
+        pandas: \$(echo \$(pandas_version.py 2>&1))
+    END_VERSIONS
+    """
+
+    stub:
+    def args = task.ext.args ?: ''
+    def outputs = metas.collect { meta -> "${meta.id}.filtered.fna" }.join(' ')
+    """
+    touch ${outputs}
+    gzip ${outputs}
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$( python --version | sed 's/Python //' )
+        biopython: \$(echo \$(biopython_version.py 2>&1))
+        pandas: \$(echo \$(pandas_version.py 2>&1))
+    END_VERSIONS
+    """
+}
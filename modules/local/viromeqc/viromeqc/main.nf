@@ -1,6 +1,6 @@
 process VIROMEQC_VIROMEQC {
     tag "$meta.id"
-    label 'process_low'
+    label 'process_medium'
 
     conda "${moduleDir}/environment.yml"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
@@ -28,6 +28,7 @@ process VIROMEQC_VIROMEQC {
         --output ${prefix}.viromeqc.tsv \\
         --bowtie2_threads $task.cpus \\
         --diamond_threads $task.cpus \\
+        --threads $task.cpus \\
         --sample_name $prefix \\
         $args
 
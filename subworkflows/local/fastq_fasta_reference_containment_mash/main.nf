@@ -6,6 +6,9 @@ include { MASH_SKETCH as MASH_SKETCH_ASSEMBLIES } from '../../../modules/nf-core
 include { MASH_SKETCH as MASH_SKETCH_REFERENCES } from '../../../modules/nf-core/mash/sketch/main'      // TODO: Update nf-core module to remove optional -r argument
 include { MASH_PASTE                            } from '../../../modules/local/mash/paste/main'         // TODO: Add module to nf-core
 include { MASH_SCREEN                           } from '../../../modules/nf-core/mash/screen/main'      // TODO: Update nf-core module to add meta to sketch
+include { MASH_SCREEN as MASH_SCREEN_ASSEMBLIES } from '../../../modules/nf-core/mash/screen/main'
+include { MASH_SCREEN as MASH_SCREEN_REFERENCES } from '../../../modules/nf-core/mash/screen/main'
+include { CAT_CAT as CAT_MASHSCREEN             } from '../../../modules/nf-core/cat/cat/main'
 
 workflow FASTQ_FASTA_REFERENCE_CONTAINMENT_MASH {
     take:
@@ -34,20 +37,46 @@ workflow FASTQ_FASTA_REFERENCE_CONTAINMENT_MASH {
         ch_versions = ch_versions.mix(MASH_SKETCH_REFERENCES.out.versions.first())
     }
 
-    //
-    // MODULE: Combine assembly and reference sketches
-    //
-    ch_combined_sketch_msh = MASH_PASTE ( ch_assembly_sketch_msh, ch_reference_sketch_msh.collect() ).msh
-    ch_versions = ch_versions.mix(MASH_PASTE.out.versions.first())
+    if ( params.mash_screen_split_sketches ) {
+        // join reads and assembly sketch by meta.id
+        ch_mash_screen_assemblies_input = fastq_gz.join( ch_assembly_sketch_msh, by:0 )
 
-    // join reads and combined sketch by meta.id
-    ch_mash_screen_input = fastq_gz.join( ch_combined_sketch_msh, by:0 )
+        //
+        // MODULE: Identify contained assemblies
+        //
+        ch_assemblies_screen_tsv = MASH_SCREEN_ASSEMBLIES ( ch_mash_screen_assemblies_input.map { [ it[0], it[1] ] }, ch_mash_screen_assemblies_input.map { [ it[0], it[2] ] } ).screen
+        ch_versions = ch_versions.mix(MASH_SCREEN_ASSEMBLIES.out.versions.first())
 
-    //
-    // MODULE: Identify contained genomes
-    //
-    ch_mash_screen_tsv = MASH_SCREEN ( ch_mash_screen_input.map { [ it[0], it[1] ] }, ch_mash_screen_input.map { [ it[0], it[2] ] } ).screen
-    ch_versions = ch_versions.mix(MASH_SCREEN.out.versions.first())
+        //
+        // MODULE: Identify contained references, reading the reference sketch in place for every sample
+        //
+        ch_references_screen_tsv = MASH_SCREEN_REFERENCES ( fastq_gz, ch_reference_sketch_msh.collect() ).screen
+        ch_versions = ch_versions.mix(MASH_SCREEN_REFERENCES.out.versions.first())
+
+        // join screens by meta.id, assemblies first as in the combined sketch
+        ch_mash_screens_tsv = ch_assemblies_screen_tsv.join( ch_references_screen_tsv, by:0 ).map { [ it[0], [ it[1], it[2] ] ] }
+
+        //
+        // MODULE: Merge assembly and reference screens
+        //
+        ch_mash_screen_tsv = CAT_MASHSCREEN ( ch_mash_screens_tsv ).file_out
+        ch_versions = ch_versions.mix(CAT_MASHSCREEN.out.versions.first())
+    } else {
+        //
+        // MODULE: Combine assembly and reference sketches
+        //
+        ch_combined_sketch_msh = MASH_PASTE ( ch_assembly_sketch_msh, ch_reference_sketch_msh.collect() ).msh
+        ch_versions = ch_versions.mix(MASH_PASTE.out.versions.first())
+
+        // join reads and combined sketch by meta.id
+        ch_mash_screen_input = fastq_gz.join( ch_combined_sketch_msh, by:0 )
+
+        //
+        // MODULE: Identify contained genomes
+        //
+        ch_mash_screen_tsv = MASH_SCREEN ( ch_mash_screen_input.map { [ it[0], it[1] ] }, ch_mash_screen_input.map { [ it[0], it[2] ] } ).screen
+        ch_versions = ch_versions.mix(MASH_SCREEN.out.versions.first())
+    }
 
     emit:
     mash_screen_results = ch_mash_screen_tsv    // [ [ meta.id ] , fasta.gz ]   , concatenated assemblies and contained references
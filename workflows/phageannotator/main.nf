@@ -12,8 +12,10 @@
 
 include { SEQKIT_SEQ                                } from '../../modules/local/seqkit/seq/main'                                    // TODO: Add to nf-core
 include { APPENDSCREENHITS                          } from '../../modules/local/appendscreenhits/main'
+include { BUILDREFERENCESTORE                       } from '../../modules/local/buildreferencestore/main'
 include { EXTRACTVIRALASSEMBLIES                    } from '../../modules/local/extractviralassemblies/main'
 include { QUALITYFILTERVIRUSES                      } from '../../modules/local/qualityfilterviruses/main'
+include { QUALITYFILTERVIRUSES_BATCH                } from '../../modules/local/qualityfilterviruses_batch/main'
 include { ANICLUSTER_ANICALC                        } from '../../modules/local/anicluster/anicalc/main'
 include { ANICLUSTER_ANICLUST                       } from '../../modules/local/anicluster/aniclust/main'
 include { ANICLUSTER_EXTRACTREPS                    } from '../../modules/local/anicluster/extractreps/main'
@@ -120,10 +122,21 @@ workflow PHAGEANNOTATOR {
         // join mash screen and assembly fasta by meta.id
         ch_append_screen_hits_input = ch_containment_results_tsv.join( ch_filtered_input_fasta_gz, by:0 )
 
+        // if requested, build a random access store of the references once, so each sample only fetches its hits
+        if ( params.reference_virus_store ) {
+            //
+            // MODULE: Build reference store
+            //
+            ch_reference_virus_store = BUILDREFERENCESTORE ( ch_reference_virus_fasta_gz ).store.first()
+            ch_versions = ch_versions.mix(BUILDREFERENCESTORE.out.versions)
+        } else {
+            ch_reference_virus_store = ch_reference_virus_fasta_gz.map { meta, fasta -> [ meta, fasta, [] ] }.first()
+        }
+
         //
         // MODULE: Append screen hits to assemblies
         //
-        ch_assembly_w_references_fasta_gz = APPENDSCREENHITS ( ch_append_screen_hits_input, ch_reference_virus_fasta_gz.first() ).assembly_w_screen_hits
+        ch_assembly_w_references_fasta_gz = APPENDSCREENHITS ( ch_append_screen_hits_input, ch_reference_virus_store ).assembly_w_screen_hits
         ch_versions = ch_versions.mix(APPENDSCREENHITS.out.versions.first())
     } else {
         // if run_reference_containment == false, skip subworkflow and use input assemblies
@@ -219,11 +232,27 @@ workflow PHAGEANNOTATOR {
         ch_quality_filter_viruses_input1 = FASTA_VIRUS_QUALITY_CHECKV.out.viruses_fna_gz.join(FASTA_VIRUS_QUALITY_CHECKV.out.proviruses_fna_gz)
         ch_quality_filter_viruses_input2 = ch_quality_filter_viruses_input1.join(FASTA_VIRUS_QUALITY_CHECKV.out.quality_summary_tsv)
 
-        //
-        // MODULE: Quality filter viruses
-        //
-        ch_filtered_viruses_fna_gz = QUALITYFILTERVIRUSES ( ch_quality_filter_viruses_input2 ).filtered_viruses
-        ch_versions = ch_versions.mix(QUALITYFILTERVIRUSES.out.versions.first())
+        if ( params.checkv_batch_size > 1 ) {
+            // create batches of samples ([ metas, viruses, proviruses, quality_summaries ]) filtered in one task
+            ch_quality_filter_viruses_batches = ch_quality_filter_viruses_input2
+                                                    .collate( params.checkv_batch_size )
+                                                    .map { batch -> batch.transpose() }
+
+            //
+            // MODULE: Quality filter viruses in batches
+            //
+            ch_filtered_viruses_fna_gz = QUALITYFILTERVIRUSES_BATCH ( ch_quality_filter_viruses_batches ).filtered_viruses
+                                            .flatMap { metas, fastas ->
+                                                metas.collect { meta -> [ meta, [ fastas ].flatten().find { it.name == "${meta.id}.filtered.fna.gz" } ] }
+                                            }
+            ch_versions = ch_versions.mix(QUALITYFILTERVIRUSES_BATCH.out.versions.first())
+        } else {
+            //
+            // MODULE: Quality filter viruses
+            //
+            ch_filtered_viruses_fna_gz = QUALITYFILTERVIRUSES ( ch_quality_filter_viruses_input2 ).filtered_viruses
+            ch_versions = ch_versions.mix(QUALITYFILTERVIRUSES.out.versions.first())
+        }
     } else {
         // if skip_checkv == false, use non-quality filtered viruses
         ch_filtered_viruses_fna_gz = ch_viruses_fna_gz
@@ -236,8 +265,20 @@ workflow PHAGEANNOTATOR {
     ------------------------------------------------------------------------------*/
     // if skip_virus_clustering == false, run subworkflow
     if ( !params.skip_virus_clustering  ) {
-        // create a channel for combining filtered viruses (sorted so output is the same for tests)
+        // if incremental clustering requested, previous clusters and their representatives must both be included
+        if ( params.anicluster_prev_clusters && params.anicluster_prev_reps ) {
+            ch_prev_clusters_tsv = file( params.anicluster_prev_clusters, checkIfExists:true )
+            ch_prev_reps_fna_gz = Channel.value( [ [ id:'previous_representatives' ], file( params.anicluster_prev_reps, checkIfExists:true ) ] )
+        } else if ( params.anicluster_prev_clusters || params.anicluster_prev_reps ) {
+            error "[nf-core/phageannotator] ERROR: incremental clustering requires both --anicluster_prev_clusters and --anicluster_prev_reps"
+        } else {
+            ch_prev_clusters_tsv = []
+            ch_prev_reps_fna_gz = Channel.empty()
+        }
+
+        // create a channel for combining filtered viruses and previous representatives (sorted so output is the same for tests)
         ch_cat_viruses_input = ch_filtered_viruses_fna_gz
+                                .mix( ch_prev_reps_fna_gz )
                                 .map { [ [ id:'all_samples' ], it[1] ] }
                                 .groupTuple( sort: 'deep' )
 
@@ -264,7 +305,7 @@ workflow PHAGEANNOTATOR {
         //
         // MODULE: Cluster virus sequences based on ANI and AF
         //
-        ch_clusters_tsv = ANICLUSTER_ANICLUST ( ch_aniclust_input ).clusters
+        ch_clusters_tsv = ANICLUSTER_ANICLUST ( ch_aniclust_input, ch_prev_clusters_tsv ).clusters
         ch_versions = ch_versions.mix( ANICLUSTER_ANICLUST.out.versions )
 
         // create input for extracting cluster representatives